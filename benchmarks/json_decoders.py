@@ -0,0 +1,47 @@
+"""Compare the JSON backends on recorded API responses
+
+Usage: python -m benchmarks.json_decoders [--number N] [--extract PATH] PAYLOAD [PAYLOAD ...]
+
+The payloads are response bodies saved to files. benchmarks/payloads/twitch_streams.json is a /streams response of 100
+online streams (kraken v5 format), other responses can be saved with e.g.:
+    curl -H "Client-ID: <id>" "https://api.twitch.tv/kraken/streams/?channel=<ids>&limit=100" > streams.json
+"""
+
+import argparse
+import os
+import timeit
+
+from discord_bot.api import decoders
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the JSON backends on recorded API responses")
+    parser.add_argument("payloads", nargs="+", help="The files containing the response bodies")
+    parser.add_argument("--number", type=int, default=100, help="Number of decodings of each payload")
+    parser.add_argument("--extract", action="append", default=[],
+                        help="Also measure the extraction of this path (e.g. streams.item.channel._id), repeatable")
+    args = parser.parse_args()
+
+    backends = [(name, decoders._load_backend(name)) for name in decoders.BACKENDS]
+    for name, loads in backends:
+        if not loads:
+            print(f"{name} is not installed")
+
+    for payload in args.payloads:
+        with open(payload, "rb") as f:
+            data = f.read()
+        print(f"\n{os.path.basename(payload)} ({len(data)} bytes, {args.number} decodings)")
+
+        for name, loads in backends:
+            if loads:
+                duration = timeit.timeit(lambda: loads(data), number=args.number)
+                print(f"  {name:<12} {duration / args.number * 1000:8.3f} ms")
+
+        if args.extract:
+            extractor = "ijson" if decoders.ijson else "json"
+            duration = timeit.timeit(lambda: decoders.extract(data, *args.extract), number=args.number)
+            print(f"  {'extract/' + extractor:<12} {duration / args.number * 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
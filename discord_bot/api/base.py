@@ -1,45 +1,302 @@
 import asyncio
+import json
 import logging
+import os
+import time
 
 import aiohttp
 import aiofiles
 
+from discord_bot import cfg
 from discord_bot import log
+from discord_bot import metrics
 
+from discord_bot.api import decoders
+from discord_bot.api import ratelimit
+
+CONF = cfg.CONF
 LOG = logging.getLogger('debug')
 
+# Methods whose identical concurrent requests share a single request
+COALESCED_METHODS = ["get", "head"]
+
+
+class Response:
+    """An API response whose body has already been read
+
+    The same response is returned to every caller of a coalesced request, so the decoded body is shared as well and
+    must not be modified.
+    """
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self._json = None
+
+    async def read(self):
+        return self.body
+
+    async def text(self):
+        return self.body.decode()
+
+    async def json(self):
+        if self._json is None:
+            self._json = decoders.loads(self.body)
+        return self._json
+
+    async def extract(self, *paths):
+        """Extract some values of the body without decoding the whole body (see decoders.extract)"""
+        return decoders.extract(self.body, *paths)
+
+
+class ConnectionPool:
+    """Connection pool shared by the API clients
+
+    The aiohttp connector is created when it is first used, inside the running event loop.
+    """
+
+    def __init__(self):
+        self.connector = None
+        metrics.gauge("http_pool_acquired_connections", "Number of connections in use in the API clients pool") \
+            .set_function(lambda: self.get_stats()['acquired'])
+        metrics.gauge("http_pool_idle_connections", "Number of idle connections in the API clients pool") \
+            .set_function(lambda: self.get_stats()['idle'])
+
+    def get_connector(self):
+        if not self.connector or self.connector.closed:
+            self.connector = aiohttp.TCPConnector(limit=CONF.HTTP_POOL_LIMIT,
+                                                  limit_per_host=CONF.HTTP_POOL_LIMIT_PER_HOST,
+                                                  keepalive_timeout=CONF.HTTP_KEEPALIVE_TIMEOUT,
+                                                  ttl_dns_cache=CONF.HTTP_DNS_CACHE_TTL)
+        return self.connector
+
+    def get_stats(self):
+        """Return the number of connections in use and the number of idle connections"""
+        if not self.connector or self.connector.closed:
+            return {'acquired': 0, 'idle': 0}
+        return {
+            'acquired': len(self.connector._acquired),
+            'idle': sum(len(connections) for connections in self.connector._conns.values())
+        }
+
+    async def close(self):
+        if self.connector:
+            await self.connector.close()
+            self.connector = None
+
 
 class APIClient:
+    """Base class of the API clients
+
+    :param base_url: The url prepended to the requested uris
+    :param pool: The ConnectionPool shared with the other clients, the client has its own connections if None
+    :param cache: An optional http_cache.HTTPCache storing the GET responses
+    :param rate_limiter: An optional ratelimit.TokenBucket the requests have to wait for
+    :param timeout: Maximum duration of a request in seconds, HTTP_TIMEOUT if None
+    :param kwargs: The parameters of the aiohttp.ClientSession (e.g. the headers)
+    """
 
-    def __init__(self, base_url, *args, **kwargs):
+    def __init__(self, base_url, pool=None, cache=None, rate_limiter=None, timeout=None, **kwargs):
         self.base_url = base_url
-        self.session = aiohttp.ClientSession(*args, **kwargs)
+        self.pool = pool
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.session_kwargs = kwargs
+        self.session = None
+        self.is_closed = False
+        self.pending_requests = {}
 
-    async def request(self, method, uri, **kwargs):
+    def _get_session(self):
+        """Create the session when it is first used, inside the running event loop"""
+        if self.is_closed:
+            # The requests still running after close() (e.g. the tasks of an unloaded cog) must not reopen a session
+            raise RuntimeError("The API client is closed")
+        if not self.session or self.session.closed:
+            timeout = aiohttp.ClientTimeout(total=self.timeout or CONF.HTTP_TIMEOUT, connect=CONF.HTTP_CONNECT_TIMEOUT)
+            if self.pool:
+                self.session = aiohttp.ClientSession(connector=self.pool.get_connector(), connector_owner=False,
+                                                     timeout=timeout, **self.session_kwargs)
+            else:
+                self.session = aiohttp.ClientSession(timeout=timeout, **self.session_kwargs)
+        return self.session
+
+    async def close(self):
+        self.is_closed = True
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, method, uri, priority=ratelimit.NORMAL_PRIORITY, **kwargs):
+        """Send a request
+
+        The identical concurrent GET requests (same method, url and parameters) share a single request and a single
+        response.
+
+        :param method: The HTTP method
+        :param uri: The uri, relative to the base url
+        :param priority: The priority of the request when it waits for the rate limiter
+        :param kwargs: The parameters of aiohttp.ClientSession.request
+        :return: The response, None if the request failed
+        """
         url = self.base_url + uri
+        if method.lower() not in COALESCED_METHODS:
+            return await self._request(method, url, priority, **kwargs)
+
+        key = (method.lower(), url, json.dumps(kwargs, sort_keys=True, default=str))
+        request = self.pending_requests.get(key)
+        if not request:
+            if method.lower() == "get" and self.cache:
+                request = asyncio.ensure_future(self._cached_request(uri, priority, **kwargs))
+            else:
+                request = asyncio.ensure_future(self._request(method, url, priority, **kwargs))
+            self.pending_requests[key] = request
+            request.add_done_callback(lambda _: self.pending_requests.pop(key, None))
+
+        # The request is shielded to not be cancelled for the other callers if this call is cancelled
+        return await asyncio.shield(request)
+
+    async def _cached_request(self, uri, priority, **kwargs):
+        """Send a GET request unless the cache has a fresh response, revalidating the stale response if any"""
+        is_cached, ttl = self.cache.get_policy(uri)
+        if not is_cached:
+            return await self._request("get", self.base_url + uri, priority, **kwargs)
+
+        key = self.base_url + uri + json.dumps(kwargs, sort_keys=True, default=str)
+        entry = await self.cache.get(key, Response)
+        if entry and entry.is_fresh:
+            self.cache.hits += 1
+            return entry.response
+
+        self.cache.misses += 1
+        if entry:
+            kwargs["headers"] = {**kwargs.get("headers", {}), **entry.validators}
+        response = await self._request("get", self.base_url + uri, priority, **kwargs)
+
+        if response and response.status == 304 and entry:
+            self.cache.refresh(entry, response, ttl)
+            return entry.response
+        if response and response.status == 200:
+            await self.cache.set(key, response, ttl)
+        return response
+
+    async def _request(self, method, url, priority=ratelimit.NORMAL_PRIORITY, **kwargs):
+        """Send a request, the rate limited (429) and failed (5xx) requests are retried after a jittered backoff"""
+        for attempt in range(CONF.HTTP_MAX_RETRIES + 1):
+            if self.rate_limiter:
+                await self.rate_limiter.acquire(priority)
+
+            try:
+                async with self._get_session().request(method, url, **kwargs) as r:
+                    if self.rate_limiter:
+                        self.rate_limiter.update(r.headers)
+
+                    status_code = r.status
+                    if 200 <= status_code < 300 or status_code == 304:
+                        return Response(status_code, r.headers, await r.read())
+                    elif status_code == 429 or 500 <= status_code < 600:
+                        delay = ratelimit.get_backoff_duration(attempt, CONF.HTTP_RETRY_BASE_DELAY,
+                                                               CONF.HTTP_RETRY_MAX_DELAY)
+                        if status_code == 429:
+                            # The rate limiter makes the next requests wait as well
+                            retry_after = self._get_retry_after(r.headers)
+                            if self.rate_limiter:
+                                self.rate_limiter.block(retry_after)
+                            else:
+                                delay += retry_after
+                    elif 400 < status_code < 500:
+                        LOG.error(f"Bad request {url} ({status_code})")
+                        return None
+                    else:
+                        return None
+            except Exception as e:
+                if type(e) == asyncio.TimeoutError:
+                    message = "The timeout has been reached"
+                else:
+                    message = "An error has occured"
+                message += f" while requesting the url {url}"
+
+                LOG.error(log.get_log_exception_message(message, e))
+                return None
+
+            if attempt < CONF.HTTP_MAX_RETRIES:
+                LOG.warning(f"The request didn't succeed {url} ({status_code}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+        LOG.error(f"The request didn't succeed {url} ({status_code})")
+
+    @staticmethod
+    def _get_retry_after(headers):
+        """Return the number of seconds to wait before retrying a rate limited request"""
         try:
-            r = await self.session.request(method, url, **kwargs)
-            status_code = r.status
-            if status_code == 200:
-                return r
-            elif 400 < status_code < 500:
-                LOG.error(f"Bad request {url} ({status_code})")
-            elif 500 <= status_code < 600:
-                LOG.error(f"The request didn't succeed {url} ({status_code})")
+            if "Retry-After" in headers:
+                return max(float(headers["Retry-After"]), 0)
+            if "Ratelimit-Reset" in headers:
+                return max(int(headers["Ratelimit-Reset"]) - time.time(), 0)
+        except ValueError:
+            pass
+        return 0
+
+    async def get(self, uri, priority=ratelimit.NORMAL_PRIORITY):
+        return await self.request("get", uri, priority=priority)
+
+    async def download(self, uri, filename, max_size=None, resume=False, progress_callback=None):
+        """Download a file chunk by chunk, the response is never entirely loaded in memory
+
+        :param uri: The uri, relative to the base url
+        :param filename: The path of the downloaded file
+        :param max_size: Maximum size of the file in bytes, the download is aborted and the file removed beyond
+        :param resume: If True and the file exists, only its missing bytes are requested (Range request)
+        :param progress_callback: Function called with (<downloaded bytes>, <total bytes or None>) after each chunk
+        :return: True if the file has been downloaded, False otherwise
+        """
+        url = self.base_url + uri
+        offset = os.path.getsize(filename) if resume and os.path.exists(filename) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+        # A large file can take longer than the request timeout, only the time between two reads is limited
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=CONF.HTTP_CONNECT_TIMEOUT,
+                                        sock_read=self.timeout or CONF.HTTP_TIMEOUT)
+        try:
+            async with self._get_session().get(url, headers=headers, timeout=timeout) as r:
+                if r.status == 416 and offset:
+                    # The requested range starts at the end of the file: it is already complete
+                    return True
+                if r.status not in [200, 206]:
+                    LOG.error(f"The download didn't succeed {url} ({r.status})")
+                    return False
+                if r.status == 200:
+                    # The server ignored the range, the file is downloaded again from the start
+                    offset = 0
+
+                total_size = offset + r.content_length if r.content_length is not None else None
+                if max_size and total_size and total_size > max_size:
+                    LOG.error(f"The file {url} is too large ({total_size} bytes)")
+                    return False
+
+                size = offset
+                async with aiofiles.open(filename, "ab" if offset else "wb") as f:
+                    async for chunk in r.content.iter_chunked(CONF.HTTP_DOWNLOAD_CHUNK_SIZE):
+                        size += len(chunk)
+                        if max_size and size > max_size:
+                            break
+                        await f.write(chunk)
+                        if progress_callback:
+                            progress_callback(size, total_size)
+
+            if max_size and size > max_size:
+                LOG.error(f"The file {url} is too large (more than {max_size} bytes)")
+                os.remove(filename)
+                return False
         except Exception as e:
             if type(e) == asyncio.TimeoutError:
                 message = "The timeout has been reached"
             else:
                 message = "An error has occured"
-            message += f" while requesting the url {url}"
+            message += f" while downloading the url {url}"
 
             LOG.error(log.get_log_exception_message(message, e))
+            return False
 
-    async def get(self, uri):
-        return await self.request("get", uri)
-
-    async def download(self, uri, filename):
-        content = await (await self.get(uri)).read()
-        async with aiofiles.open(filename, "wb") as f:
-            await f.write(content)
         return True
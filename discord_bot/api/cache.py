@@ -0,0 +1,152 @@
+import collections
+import hashlib
+import os
+import time
+import zlib
+
+import aiofiles
+
+
+class TTLCache:
+    """In-memory LRU cache whose entries expire after a given duration
+
+    :param maxsize: Maximum number of entries, the least recently used entry is evicted first
+    :param ttl: Number of seconds an entry is kept
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+
+        value, expiration_date = entry
+        if expiration_date < time.monotonic():
+            del self.entries[key]
+            return default
+
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.entries[key] = (value, time.monotonic() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self.entries.pop(key, None)
+        return entry[0] if entry else default
+
+
+class LRUCache:
+    """In-memory cache keeping the most recently used entries
+
+    :param maxsize: Maximum number of entries
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            return default
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def set(self, key, value):
+        """Store an entry
+
+        :return: The list of the evicted entries [(<key>, <value>), ...]
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        evicted_entries = []
+        while len(self.entries) > self.maxsize:
+            evicted_entries.append(self.entries.popitem(last=False))
+        return evicted_entries
+
+    def pop(self, key, default=None):
+        return self.entries.pop(key, default)
+
+
+class DiskStore:
+    """Size-bounded on-disk key/value store, the least recently written entries are evicted first
+
+    The sizes of the entries are kept in memory, the directory is only scanned when the store is created.
+
+    :param directory: The directory of the entries, created if needed
+    :param max_size: Maximum total size of the entries in bytes
+    :param compress: If True, the values are compressed with zlib
+    """
+
+    def __init__(self, directory, max_size, compress=False):
+        self.directory = directory
+        self.max_size = max_size
+        self.compress = compress
+        os.makedirs(directory, exist_ok=True)
+
+        # {<path>: <size>} from the least recently written entry
+        self.sizes = collections.OrderedDict()
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            self.sizes[entry.path] = entry.stat().st_size
+        self.size = sum(self.sizes.values())
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest())
+
+    async def get(self, key):
+        path = self._get_path(key)
+        try:
+            async with aiofiles.open(path, "rb") as f:
+                value = await f.read()
+        except FileNotFoundError:
+            return None
+        return zlib.decompress(value) if self.compress else value
+
+    async def set(self, key, value):
+        if self.compress:
+            value = zlib.compress(value)
+        path = self._get_path(key)
+        async with aiofiles.open(path, "wb") as f:
+            await f.write(value)
+
+        self.size += len(value) - self.sizes.pop(path, 0)
+        self.sizes[path] = len(value)
+        self._evict()
+
+    def remove(self, key):
+        path = self._get_path(key)
+        self.size -= self.sizes.pop(path, 0)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self.size > self.max_size and self.sizes:
+            path, size = self.sizes.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,93 @@
+import importlib
+import io
+import json
+import logging
+
+from discord_bot import cfg
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+CONF = cfg.CONF
+LOG = logging.getLogger('debug')
+
+# The JSON backends by order of preference, the first installed one is used
+BACKENDS = ["orjson", "rapidjson", "ujson", "json"]
+
+# The ijson events of the values which are not containers
+SCALAR_EVENTS = ["null", "boolean", "integer", "double", "number", "string"]
+
+
+def _load_backend(name):
+    """Return the loads function of a backend, None if it isn't installed"""
+    try:
+        module = importlib.import_module(name)
+    except ImportError:
+        return None
+    return module.loads
+
+
+def get_loads(name=None):
+    """Return the JSON decoding function of a backend
+
+    :param name: The name of the backend, the fastest installed backend if None
+    :return: (<backend name>, <function decoding bytes>)
+    """
+    names = [name] if name else BACKENDS
+    for backend_name in names:
+        loads = _load_backend(backend_name)
+        if loads:
+            return backend_name, loads
+    LOG.warning(f"The JSON backend '{name}' is not installed, the standard json module is used")
+    return "json", json.loads
+
+
+# The backend is selected when the first document is decoded, once the configuration is loaded
+_loads = None
+
+
+def loads(data):
+    """Decode a JSON document with the selected backend
+
+    :param data: The document as bytes
+    """
+    global _loads
+    if _loads is None:
+        backend_name, _loads = get_loads(getattr(CONF, "JSON_BACKEND", None))
+        LOG.debug(f"The JSON documents are decoded with {backend_name}")
+    return _loads(data)
+
+
+def extract(data, *paths):
+    """Extract some values of a JSON document without decoding the whole document
+
+    The document is parsed as a stream with ijson if it is installed, only the requested values being built. Otherwise,
+    the document is decoded and the values are searched in the decoded object.
+
+    :param data: The document as bytes
+    :param paths: The paths of the values in the ijson prefix syntax, "item" matching every element of an array
+    (e.g. "streams.item.channel._id"). The values must not be objects or arrays.
+    :return: {<path>: [<value>, ...]}
+    """
+    values = {path: [] for path in paths}
+    if ijson:
+        for prefix, event, value in ijson.parse(io.BytesIO(data), use_float=True):
+            if prefix in values and event in SCALAR_EVENTS:
+                values[prefix].append(value)
+    else:
+        document = loads(data)
+        for path in paths:
+            values[path] = list(_find(document, path.split(".") if path else []))
+    return values
+
+
+def _find(node, keys):
+    if not keys:
+        yield node
+    elif keys[0] == "item" and isinstance(node, list):
+        for element in node:
+            yield from _find(element, keys[1:])
+    elif isinstance(node, dict) and keys[0] in node:
+        yield from _find(node[keys[0]], keys[1:])
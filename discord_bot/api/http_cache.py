@@ -0,0 +1,152 @@
+import email.utils
+import json
+import logging
+import re
+import time
+
+from multidict import CIMultiDict
+
+from discord_bot import metrics
+
+from discord_bot.api import cache
+
+LOG = logging.getLogger('debug')
+
+
+class CachedResponse:
+    """A cached response and the data needed to know if it is fresh or to revalidate it"""
+
+    def __init__(self, response, expiration_date):
+        self.response = response
+        self.expiration_date = expiration_date
+
+    @property
+    def is_fresh(self):
+        return time.time() < self.expiration_date
+
+    @property
+    def validators(self):
+        """Return the headers of a conditional request revalidating the response"""
+        headers = {}
+        if "ETag" in self.response.headers:
+            headers["If-None-Match"] = self.response.headers["ETag"]
+        if "Last-Modified" in self.response.headers:
+            headers["If-Modified-Since"] = self.response.headers["Last-Modified"]
+        return headers
+
+    def dump(self):
+        metadata = {
+            'status': self.response.status,
+            'headers': list(self.response.headers.items()),
+            'expiration_date': self.expiration_date
+        }
+        return json.dumps(metadata).encode() + b"\n" + self.response.body
+
+    @classmethod
+    def load(cls, data, response_class):
+        metadata, _, body = data.partition(b"\n")
+        metadata = json.loads(metadata.decode())
+        response = response_class(metadata['status'], CIMultiDict(metadata['headers']), body)
+        return cls(response, metadata['expiration_date'])
+
+
+class HTTPCache:
+    """Cache of the GET responses of an API client
+
+    The responses are kept in an in-memory LRU, the entries evicted from the memory being spilled on the disk if a
+    directory is given. The freshness of a response follows its Cache-Control and Expires headers, unless the policy
+    of its endpoint forces a TTL. A stale response is revalidated with If-None-Match/If-Modified-Since, a 304 answer
+    making it fresh again.
+
+    :param name: The name of the cache in the metrics
+    :param policies: [(<uri regex>, <ttl in seconds, or None to follow the response headers>), ...], the responses of
+    the uris which don't match any policy are not cached
+    :param maxsize: Maximum number of responses in memory
+    :param directory: The directory of the on-disk entries, None to only cache in memory
+    :param max_disk_size: Maximum size of the on-disk entries in bytes
+    """
+
+    def __init__(self, name, policies, maxsize, directory=None, max_disk_size=0):
+        self.policies = [(re.compile(pattern), ttl) for pattern, ttl in policies]
+        self.memory = cache.LRUCache(maxsize)
+        self.disk = cache.DiskStore(directory, max_disk_size) if directory else None
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        metrics.gauge(f"http_cache_{name}_hits", f"Number of fresh responses read from the {name} cache") \
+            .set_function(lambda: self.hits)
+        metrics.gauge(f"http_cache_{name}_misses", f"Number of responses missing from the {name} cache") \
+            .set_function(lambda: self.misses)
+        metrics.gauge(f"http_cache_{name}_revalidations", f"Number of responses of the {name} cache revalidated "
+                      "by a 304 answer").set_function(lambda: self.revalidations)
+
+    def get_policy(self, uri):
+        """Return (True, <ttl>) if the responses of the uri are cached, (False, None) otherwise"""
+        for pattern, ttl in self.policies:
+            if pattern.search(uri):
+                return True, ttl
+        return False, None
+
+    async def get(self, key, response_class):
+        entry = self.memory.get(key)
+        if entry is None and self.disk:
+            data = await self.disk.get(key)
+            if data:
+                entry = CachedResponse.load(data, response_class)
+                await self._store(key, entry)
+        return entry
+
+    async def set(self, key, response, ttl=None):
+        """Store a response if its headers allow it
+
+        :param key: The cache key
+        :param response: The response to store
+        :param ttl: The TTL forced by the policy of the endpoint
+        :return: The cache entry, None if the response can't be stored
+        """
+        expiration_date = self._get_expiration_date(response, ttl)
+        if expiration_date is None:
+            return None
+        entry = CachedResponse(response, expiration_date)
+        await self._store(key, entry)
+        return entry
+
+    def refresh(self, entry, response, ttl=None):
+        """Update the expiration date of an entry revalidated by a 304 response"""
+        self.revalidations += 1
+        entry.expiration_date = self._get_expiration_date(response, ttl) or time.time()
+
+    async def _store(self, key, entry):
+        for evicted_key, evicted_entry in self.memory.set(key, entry):
+            if self.disk:
+                await self.disk.set(evicted_key, evicted_entry.dump())
+
+    @staticmethod
+    def _get_expiration_date(response, ttl):
+        if ttl is not None:
+            return time.time() + ttl
+
+        cache_control = [directive.strip().lower()
+                         for directive in response.headers.get("Cache-Control", "").split(",")]
+        if "no-store" in cache_control:
+            return None
+        if "no-cache" in cache_control:
+            return time.time()
+        for directive in cache_control:
+            if directive.startswith("max-age="):
+                try:
+                    return time.time() + int(directive[len("max-age="):])
+                except ValueError:
+                    pass
+
+        if "Expires" in response.headers:
+            try:
+                return email.utils.parsedate_to_datetime(response.headers["Expires"]).timestamp()
+            except (TypeError, ValueError):
+                return time.time()
+
+        # Without freshness information, the response can only be reused after a revalidation
+        if "ETag" in response.headers or "Last-Modified" in response.headers:
+            return time.time()
+        return None
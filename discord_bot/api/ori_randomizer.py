@@ -1,7 +1,11 @@
+import hashlib
 import logging
 
 from discord_bot.api import base
+from discord_bot.api import cache
+from discord_bot.api import decoders
 from discord_bot import cfg
+from discord_bot import metrics
 
 CONF = cfg.CONF
 LOG = logging.getLogger('debug')
@@ -40,13 +44,74 @@ PRESETS = {
 AMBIGUOUS_PRESETS = ["hard", "glitched", "ohko", "0xp"]
 
 
+def get_params(seed, preset, key_mode=None, path_diff=None, variations=[], logic_paths=[], flags=[]):
+    """ Build the parameters of a seed generation
+
+    :param seed: The seed number
+    :param preset: The seed logic mode preset
+    :param key_mode: The seed mode
+    :param path_diff: The seed path difficulty
+    :param variations: An optional list of variations
+    :param logic_paths: An optional list of addtional logic paths
+    :param flags: Any other flags
+    :return: The sorted list of parameters [(<name>, <value>), ...], the same parameters always give the same list
+    """
+
+    params = {("seed", seed)}
+
+    if "tracking" not in flags:
+        params.add(("tracking", "Disabled"))
+
+    if "verbose_paths" in flags:
+        params.add(("verbose_paths", "on"))
+
+    if "classic_gen" in flags:
+        params.add(("gen_mode", "Classic"))
+
+    if key_mode:
+        params.add(("key_mode", key_mode.capitalize()))
+
+    if path_diff:
+        params.add(("path_diff", path_diff.capitalize()))
+    elif preset in HARD_PRESETS:
+        params.add(("path_diff", "Hard"))
+
+    logic_paths = set(PRESETS[preset] + logic_paths)
+    params = params | {("path", path) for path in logic_paths}
+
+    if preset in PRESET_VARS:
+        variations = set(variations + PRESET_VARS[preset])
+    params = params | {("var", VARIATIONS[v]) for v in variations}
+
+    return sorted(params)
+
+
 class OriRandomizerAPIClient(base.APIClient):
 
-    def __init__(self):
-        super(OriRandomizerAPIClient, self).__init__(base_url=CONF.SEEDGEN_API_URL)
+    def __init__(self, pool=None):
+        # A generation can take longer than the other API requests
+        super(OriRandomizerAPIClient, self).__init__(base_url=CONF.SEEDGEN_API_URL, pool=pool,
+                                                     timeout=CONF.SEEDGEN_TIMEOUT)
 
-    async def get_data(self, seed, preset, key_mode=None, path_diff=None, variations=[], logic_paths=[], flags=[]):
-        """ Retrieve the seed and spoiler download links
+        # The generation is deterministic for given parameters: the results are stored by parameters, in memory and
+        # compressed on the disk if a directory is given
+        self.results = cache.LRUCache(CONF.SEEDGEN_CACHE_SIZE)
+        self.results_disk = None
+        if CONF.SEEDGEN_CACHE_DIR:
+            self.results_disk = cache.DiskStore(CONF.SEEDGEN_CACHE_DIR, CONF.SEEDGEN_CACHE_DISK_SIZE, compress=True)
+
+        self.hits = 0
+        self.misses = 0
+        metrics.gauge("seedgen_cache_hits", "Number of seeds read from the seed cache") \
+            .set_function(lambda: self.hits)
+        metrics.gauge("seedgen_cache_misses", "Number of seeds missing from the seed cache") \
+            .set_function(lambda: self.misses)
+
+    async def get_data(self, seed, preset, key_mode=None, path_diff=None, variations=[], logic_paths=[], flags=[],
+                       cache=False):
+        """ Retrieve the seed and spoiler data
+
+        The seeds with tracking are never cached since each generation creates a new game to track.
 
         :param seed: The seed number
         :param preset: The seed logic mode preset
@@ -55,36 +120,37 @@ class OriRandomizerAPIClient(base.APIClient):
         :param variations: An optional list of variations
         :param logic_paths: An optional list of addtional logic paths
         :param flags: Any other flags
+        :param cache: If True, the seed is read from and stored in the cache (e.g. a seed code which can be requested
+        again), the random seeds are not cached
         :return: seed and spoiler data
         """
-
-        params = {("seed", seed)}
-
-        if "tracking" not in flags:
-            params.add(("tracking", "Disabled"))
-
-        if "verbose_paths" in flags:
-            params.add(("verbose_paths", "on"))
-
-        if "classic_gen" in flags:
-            params.add(("gen_mode", "Classic"))
-
-        if key_mode:
-            params.add(("key_mode", key_mode.capitalize()))
-
-        if path_diff:
-            params.add(("path_diff", path_diff.capitalize()))
-        elif preset in HARD_PRESETS:
-            params.add(("path_diff", "Hard"))
-
-        logic_paths = set(PRESETS[preset] + logic_paths)
-        params = params | {("path", path) for path in logic_paths}
-
-        if preset in PRESET_VARS:
-            variations = set(variations + PRESET_VARS[preset])
-        params = params | {("var", VARIATIONS[v]) for v in variations}
-
+        params = get_params(seed, preset, key_mode, path_diff, variations, logic_paths, flags)
         LOG.debug(f"Parameters used for the seed generation: {params}")
 
-        url = "/generator/json?" + "&".join([f"{param[0]}={param[1]}" for param in params])
-        return await (await self.get(url)).json()
+        query = "&".join([f"{param[0]}={param[1]}" for param in params])
+        key = hashlib.sha256(query.encode()).hexdigest()
+        is_cached = cache and "tracking" not in flags
+
+        if is_cached:
+            data = await self._get_cached_data(key)
+            if data is not None:
+                self.hits += 1
+                return data
+            self.misses += 1
+
+        response = await self.get("/generator/json?" + query)
+        data = await response.json()
+        if is_cached:
+            self.results.set(key, data)
+            if self.results_disk:
+                await self.results_disk.set(key, response.body)
+        return data
+
+    async def _get_cached_data(self, key):
+        data = self.results.get(key)
+        if data is None and self.results_disk:
+            body = await self.results_disk.get(key)
+            if body:
+                data = decoders.loads(body)
+                self.results.set(key, data)
+        return data
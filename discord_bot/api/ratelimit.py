@@ -0,0 +1,97 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+
+LOG = logging.getLogger('debug')
+
+# The waiting requests of the lowest priority value are sent first
+HIGH_PRIORITY = 0
+NORMAL_PRIORITY = 1
+
+
+class TokenBucket:
+    """Token bucket limiting the request rate of an API client
+
+    Every request takes a token, the tokens being refilled at a constant rate. When the bucket is empty, the requests
+    wait for a token instead of failing, by priority then in order of arrival. The bucket follows the rate limit
+    headers of the API responses (Ratelimit-Limit, Ratelimit-Remaining and Ratelimit-Reset, the date when the bucket
+    is full again).
+
+    :param capacity: Maximum number of tokens
+    :param period: Number of seconds needed to refill an empty bucket
+    """
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.refill_rate = capacity / period
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.waiters = []
+        self.counter = itertools.count()
+        self.wake_up_handle = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    async def acquire(self, priority=NORMAL_PRIORITY):
+        """Take a token, waiting until one is available"""
+        self._refill()
+        if not self.waiters and self.tokens >= 1:
+            self.tokens -= 1
+            return
+
+        # The cancelled waiters stay in the heap and are skipped when they are popped
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        if not self.wake_up_handle:
+            self._wake_up()
+        await future
+
+    def _wake_up(self):
+        """Give the available tokens to the first waiters and schedule the next wake up if some are left"""
+        self.wake_up_handle = None
+        self._refill()
+        while self.waiters and self.tokens >= 1:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                self.tokens -= 1
+                future.set_result(None)
+
+        if self.waiters:
+            delay = (1 - self.tokens) / self.refill_rate
+            self.wake_up_handle = asyncio.get_event_loop().call_later(delay, self._wake_up)
+
+    def update(self, headers):
+        """Synchronize the bucket with the rate limit headers of a response"""
+        try:
+            limit = int(headers["Ratelimit-Limit"]) if "Ratelimit-Limit" in headers else None
+            remaining = int(headers["Ratelimit-Remaining"]) if "Ratelimit-Remaining" in headers else None
+            reset_date = int(headers["Ratelimit-Reset"]) if "Ratelimit-Reset" in headers else None
+        except ValueError:
+            LOG.warning("Cannot parse the rate limit headers")
+            return
+
+        self._refill()
+        if limit:
+            self.capacity = limit
+        if remaining is not None:
+            # The requests still in flight have already taken their token, the lowest count is kept
+            self.tokens = min(self.tokens, remaining)
+            refill_duration = reset_date - time.time() if reset_date else 0
+            if refill_duration > 0:
+                self.refill_rate = max(self.capacity - remaining, 1) / refill_duration
+
+    def block(self, duration):
+        """Empty the bucket when the API rejected a request (429), no token is available for the duration"""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - duration * self.refill_rate
+
+
+def get_backoff_duration(attempt, base_delay, max_delay):
+    """Return the jittered delay before the given retry (exponential backoff with full jitter)"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
@@ -1,8 +1,12 @@
+import asyncio
 import logging
 
 from discord_bot.api import base
+from discord_bot.api import cache
+from discord_bot.api import ratelimit
 from discord_bot import cfg
 from discord_bot import log
+from discord_bot import utils
 
 
 CONF = cfg.CONF
@@ -16,14 +20,61 @@ HEADERS = {
 
 class TwitchAPIClient(base.APIClient):
 
-    def __init__(self):
-        super(TwitchAPIClient, self).__init__(base_url=CONF.TWITCH_API_URL, headers=HEADERS)
+    def __init__(self, pool=None):
+        rate_limiter = ratelimit.TokenBucket(CONF.TWITCH_API_RATE_LIMIT, CONF.TWITCH_API_RATE_LIMIT_PERIOD)
+        super(TwitchAPIClient, self).__init__(base_url=CONF.TWITCH_API_URL, pool=pool, rate_limiter=rate_limiter,
+                                              headers=HEADERS)
+        self.ids_cache = cache.TTLCache(CONF.TWITCH_IDS_CACHE_SIZE, CONF.TWITCH_IDS_CACHE_TTL)
+        self.pending_ids = {}
+
+    def cache_ids(self, ids_by_name):
+        """Store known user ids in the cache
+
+        :param ids_by_name: {<name>: <id>}
+        """
+        for name, twitch_id in ids_by_name.items():
+            self.ids_cache.set(name, twitch_id)
 
     async def get_ids(self, *names):
         """Retrieve all user ids.
 
+        The ids are read from the cache when possible. The other names are requested by chunks of
+        TWITCH_API_CHUNK_SIZE names, the API calls being shared with the concurrent calls looking for the same names.
+
         :param names: names whose we want the id
+        :return: {<name>: <id>}, None if the API call failed
         """
+        result = {name: self.ids_cache.get(name) for name in names if name in self.ids_cache}
+
+        # Wait for the names which are already requested and request the others
+        requests = {self.pending_ids[name] for name in names if name not in result and name in self.pending_ids}
+        missing_names = [name for name in names if name not in result and name not in self.pending_ids]
+        for chunk in utils.chunks(missing_names, CONF.TWITCH_API_CHUNK_SIZE):
+            requests.add(self._request_ids(chunk))
+
+        for request in requests:
+            # The request is shielded to not be cancelled for the other callers if this call is cancelled
+            ids_by_name = await asyncio.shield(request)
+            if ids_by_name is None:
+                return None
+            result.update({name: twitch_id for name, twitch_id in ids_by_name.items() if name in names})
+        return result
+
+    def _request_ids(self, names):
+        """Start an API call retrieving the ids of the names, and register it as pending until it is done"""
+        request = asyncio.ensure_future(self._get_ids(*names))
+        for name in names:
+            self.pending_ids[name] = request
+
+        def on_done(_):
+            for name in names:
+                if self.pending_ids.get(name) is request:
+                    del self.pending_ids[name]
+
+        request.add_done_callback(on_done)
+        return request
+
+    async def _get_ids(self, *names):
         uri = f"/users?login={','.join(names)}"
         try:
             body = await (await self.get(uri)).json()
@@ -33,22 +84,109 @@ class TwitchAPIClient(base.APIClient):
             LOG.error(log.get_log_exception_message(message, e))
         else:
             result = {user['name']: user['_id'] for user in users}
+            self.cache_ids(result)
             LOG.debug(f"API data for {list(names)}: {result} ({uri})")
             return result
 
     async def get_status(self, *twitch_ids):
         """Retrieve all stream status.
 
+        The ids are split into chunks small enough for a single API call. The chunks are requested concurrently (at
+        most TWITCH_API_MAX_CONCURRENT_REQUESTS at a time) and their results are merged.
+
+        :param twitch_ids: twitch ids whose we want the status
+        :return: a dictionary {<twitch_id>: <stream data if online, None if offline>} which only contains the ids of
+        the chunks that have successfully been retrieved, or None if no chunk could be retrieved
+        """
+        semaphore = asyncio.Semaphore(CONF.TWITCH_API_MAX_CONCURRENT_REQUESTS)
+
+        async def get_chunk_status(chunk):
+            async with semaphore:
+                return chunk, await self._get_chunk_status(chunk)
+
+        twitch_ids = [int(twitch_id) for twitch_id in twitch_ids]
+        chunks = utils.chunks(twitch_ids, CONF.TWITCH_API_CHUNK_SIZE)
+        results = await asyncio.gather(*[get_chunk_status(chunk) for chunk in chunks])
+
+        status = {}
+        failed_chunks = 0
+        for chunk, streams in results:
+            if streams is None:
+                failed_chunks += 1
+            else:
+                status.update({twitch_id: streams.get(twitch_id) for twitch_id in chunk})
+
+        if failed_chunks:
+            LOG.warning(f"Cannot retrieve the status of {failed_chunks}/{len(results)} chunks of streams")
+            if failed_chunks == len(results):
+                return None
+        return status
+
+    async def _get_chunk_status(self, twitch_ids):
+        """Retrieve the status of a chunk of streams in a single API call.
+
+        The polling requests are sent before the other requests waiting for the rate limiter.
+
         :param twitch_ids: twitch ids whose we want the status
+        :return: a dictionary {<twitch_id>: <stream data>} for the online streams, None if the API call failed
         """
         ids = ','.join([str(twitch_id) for twitch_id in twitch_ids])
-        uri = f"/streams/?channel={ids}"
+        uri = f"/streams/?channel={ids}&limit={len(twitch_ids)}"
         try:
-            body = await (await self.get(uri)).json()
+            body = await (await self.get(uri, priority=ratelimit.HIGH_PRIORITY)).json()
             streams = body['streams']
         except (AttributeError, KeyError, TypeError) as e:
             message = "Cannot retrieve stream data"
             LOG.error(log.get_log_exception_message(message, e))
         else:
-            return {stream['channel']['_id']: stream for stream in streams}
+            return {int(stream['channel']['_id']): stream for stream in streams}
+
+
+class TwitchEventSubAPIClient(base.APIClient):
+    """Manage the webhook subscriptions to the stream events (Twitch EventSub)"""
+
+    def __init__(self, pool=None):
+        headers = {"Client-ID": CONF.TWITCH_API_CLIENT_ID, "Authorization": f"Bearer {CONF.TWITCH_API_APP_TOKEN}"}
+        rate_limiter = ratelimit.TokenBucket(CONF.TWITCH_API_RATE_LIMIT, CONF.TWITCH_API_RATE_LIMIT_PERIOD)
+        super(TwitchEventSubAPIClient, self).__init__(base_url=CONF.TWITCH_EVENTSUB_API_URL, pool=pool,
+                                                      rate_limiter=rate_limiter, headers=headers)
+
+    async def get_subscriptions(self):
+        """Retrieve all the subscriptions of the application.
+
+        :return: a list of subscriptions, None if the API call failed
+        """
+        subscriptions = []
+        cursor = None
+        while True:
+            uri = "/subscriptions" + (f"?after={cursor}" if cursor else "")
+            try:
+                body = await (await self.get(uri)).json()
+                subscriptions += body['data']
+                cursor = body.get('pagination', {}).get('cursor')
+            except (AttributeError, KeyError, TypeError) as e:
+                message = "Cannot retrieve the subscriptions"
+                LOG.error(log.get_log_exception_message(message, e))
+                return None
+            if not cursor:
+                return subscriptions
+
+    async def create_subscription(self, event_type, twitch_id, callback, secret):
+        """Subscribe to an event of a stream.
+
+        :param event_type: stream.online or stream.offline
+        :param twitch_id: The stream id
+        :param callback: The url of the webhook receiver
+        :param secret: The secret used to sign the callbacks
+        :return: True if the subscription has been created
+        """
+        data = {
+            "type": event_type,
+            "version": "1",
+            "condition": {"broadcaster_user_id": str(twitch_id)},
+            "transport": {"method": "webhook", "callback": callback, "secret": secret}
+        }
+        return await self.request("post", "/subscriptions", json=data) is not None
 
+    async def delete_subscription(self, subscription_id):
+        return await self.request("delete", f"/subscriptions?id={subscription_id}") is not None
@@ -20,15 +20,72 @@ class Config:
             self.TWITCH_API_ACCEPT = getattr(module, "TWITCH_API_ACCEPT", "application/vnd.twitchtv.v5+json")
             self.TWITCH_API_CLIENT_ID = getattr(module, "TWITCH_API_CLIENT_ID", None)
             self.MIN_OFFLINE_DURATION = getattr(module, "MIN_OFFLINE_DURATION", 60)
+            self.TWITCH_API_CHUNK_SIZE = getattr(module, "TWITCH_API_CHUNK_SIZE", 100)
+            self.TWITCH_API_MAX_CONCURRENT_REQUESTS = getattr(module, "TWITCH_API_MAX_CONCURRENT_REQUESTS", 10)
+            self.TWITCH_IDS_CACHE_SIZE = getattr(module, "TWITCH_IDS_CACHE_SIZE", 10000)
+            self.TWITCH_IDS_CACHE_TTL = getattr(module, "TWITCH_IDS_CACHE_TTL", 24 * 3600)
+            self.TWITCH_API_RATE_LIMIT = getattr(module, "TWITCH_API_RATE_LIMIT", 800)
+            self.TWITCH_API_RATE_LIMIT_PERIOD = getattr(module, "TWITCH_API_RATE_LIMIT_PERIOD", 60)
+            self.POLL_MIN_INTERVAL = getattr(module, "POLL_MIN_INTERVAL", 5)
+            self.POLL_INTERVAL = getattr(module, "POLL_INTERVAL", 10)
+            self.POLL_MAX_INTERVAL = getattr(module, "POLL_MAX_INTERVAL", 120)
+            self.POLL_DORMANT_DURATION = getattr(module, "POLL_DORMANT_DURATION", 7 * 24 * 3600)
+            self.POLL_GO_LIVE_WINDOW = getattr(module, "POLL_GO_LIVE_WINDOW", 30 * 60)
+            self.POLL_SHARDS = getattr(module, "POLL_SHARDS", 1)
+            self.POLL_SHARD_ID = getattr(module, "POLL_SHARD_ID", 0)
+            self.POLL_SHARD_CHECK_INTERVAL = getattr(module, "POLL_SHARD_CHECK_INTERVAL", 5)
+            self.POLL_SHARD_LEASE = getattr(module, "POLL_SHARD_LEASE", 300)
+            self.POLL_SHARD_RESYNC_INTERVAL = getattr(module, "POLL_SHARD_RESYNC_INTERVAL", 60)
+            self.WEBHOOK_ENABLED = getattr(module, "WEBHOOK_ENABLED", False)
+            self.WEBHOOK_HOST = getattr(module, "WEBHOOK_HOST", "0.0.0.0")
+            self.WEBHOOK_PORT = getattr(module, "WEBHOOK_PORT", 8080)
+            self.WEBHOOK_PATH = getattr(module, "WEBHOOK_PATH", "/twitch/eventsub")
+            self.WEBHOOK_CALLBACK_URL = getattr(module, "WEBHOOK_CALLBACK_URL", None)
+            self.WEBHOOK_SECRET = getattr(module, "WEBHOOK_SECRET", None)
+            self.WEBHOOK_SUBSCRIPTION_SYNC_INTERVAL = getattr(module, "WEBHOOK_SUBSCRIPTION_SYNC_INTERVAL", 60)
+            self.WEBHOOK_RECONCILIATION_INTERVAL = getattr(module, "WEBHOOK_RECONCILIATION_INTERVAL", 600)
+            self.TWITCH_EVENTSUB_API_URL = getattr(module, "TWITCH_EVENTSUB_API_URL",
+                                                   "https://api.twitch.tv/helix/eventsub")
+            self.TWITCH_API_APP_TOKEN = getattr(module, "TWITCH_API_APP_TOKEN", None)
+            self.NOTIFICATION_MAX_CONCURRENT_JOBS = getattr(module, "NOTIFICATION_MAX_CONCURRENT_JOBS", 10)
+            self.NOTIFICATION_EDIT_DEBOUNCE = getattr(module, "NOTIFICATION_EDIT_DEBOUNCE", 60)
+            self.NOTIFICATION_FLUSH_MAX_RETRIES = getattr(module, "NOTIFICATION_FLUSH_MAX_RETRIES", 5)
+
+            # STATS COG
+            self.METRICS_HOST = getattr(module, "METRICS_HOST", "0.0.0.0")
+            self.METRICS_PORT = getattr(module, "METRICS_PORT", None)
 
             # DAB COG
             self.DAB_COOLDOWN = getattr(module, "DAB_COOLDOWN", 0)
 
             # ORI RANDO COG
             self.SEEDGEN_API_URL = getattr(module, "SEEDGEN_API_URL",  "http://orirandocoopserver.appspot.com")
-            self.SEEDGEN_COOLDOWN = getattr(module, "SEEDGEN_COOLDOWN", 0)
+            self.SEEDGEN_MAX_CONCURRENT_JOBS = getattr(module, "SEEDGEN_MAX_CONCURRENT_JOBS", 4)
+            self.SEEDGEN_TIMEOUT = getattr(module, "SEEDGEN_TIMEOUT", 60)
+            self.SEEDGEN_QUEUE_UPDATE_INTERVAL = getattr(module, "SEEDGEN_QUEUE_UPDATE_INTERVAL", 5)
+            self.SEEDGEN_MAX_BATCH_SIZE = getattr(module, "SEEDGEN_MAX_BATCH_SIZE", 5)
+            self.SEEDGEN_POOL_SIZE = getattr(module, "SEEDGEN_POOL_SIZE", 3)
+            self.SEEDGEN_POOL_SETTINGS_COUNT = getattr(module, "SEEDGEN_POOL_SETTINGS_COUNT", 5)
+            self.SEEDGEN_POOL_RATE_LIMIT = getattr(module, "SEEDGEN_POOL_RATE_LIMIT", 10)
+            self.SEEDGEN_POOL_RATE_LIMIT_PERIOD = getattr(module, "SEEDGEN_POOL_RATE_LIMIT_PERIOD", 60)
+            self.SEEDGEN_CACHE_SIZE = getattr(module, "SEEDGEN_CACHE_SIZE", 256)
+            self.SEEDGEN_CACHE_DIR = getattr(module, "SEEDGEN_CACHE_DIR", None)
+            self.SEEDGEN_CACHE_DISK_SIZE = getattr(module, "SEEDGEN_CACHE_DISK_SIZE", 100 * 1024 * 1024)
             self.RANDO_ROLE = getattr(module, "RANDO_ROLE", None)
 
+            # API CLIENTS
+            self.HTTP_TIMEOUT = getattr(module, "HTTP_TIMEOUT", 30)
+            self.HTTP_CONNECT_TIMEOUT = getattr(module, "HTTP_CONNECT_TIMEOUT", 10)
+            self.HTTP_POOL_LIMIT = getattr(module, "HTTP_POOL_LIMIT", 100)
+            self.HTTP_POOL_LIMIT_PER_HOST = getattr(module, "HTTP_POOL_LIMIT_PER_HOST", 20)
+            self.HTTP_KEEPALIVE_TIMEOUT = getattr(module, "HTTP_KEEPALIVE_TIMEOUT", 30)
+            self.HTTP_DNS_CACHE_TTL = getattr(module, "HTTP_DNS_CACHE_TTL", 300)
+            self.HTTP_DOWNLOAD_CHUNK_SIZE = getattr(module, "HTTP_DOWNLOAD_CHUNK_SIZE", 64 * 1024)
+            self.HTTP_MAX_RETRIES = getattr(module, "HTTP_MAX_RETRIES", 3)
+            self.HTTP_RETRY_BASE_DELAY = getattr(module, "HTTP_RETRY_BASE_DELAY", 0.5)
+            self.HTTP_RETRY_MAX_DELAY = getattr(module, "HTTP_RETRY_MAX_DELAY", 10)
+            self.JSON_BACKEND = getattr(module, "JSON_BACKEND", None)
+
             # DATABASE
             self.DB_HOST = getattr(module, "DB_HOST", None)
             self.DB_PORT = getattr(module, "DB_PORT", 5432)
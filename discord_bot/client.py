@@ -7,6 +7,7 @@ from discord.ext import commands
 from discord_bot import cfg
 from discord_bot import log
 from discord_bot import utils
+from discord_bot.api import base
 
 CONF = cfg.CONF
 LOG = logging.getLogger('debug')
@@ -19,6 +20,8 @@ class Bot(commands.Bot):
     def __init__(self, *args, **kwargs):
         super(Bot, self).__init__(*args, **kwargs)
         self.handled_exceptions = []
+        # The connections of the API clients of all the cogs
+        self.api_pool = base.ConnectionPool()
         self.load_extensions()
 
     async def on_ready(self):
@@ -67,6 +70,10 @@ class Bot(commands.Bot):
             message = "Cannot connect to the websocket"
             LOG.error(log.get_log_exception_message(message, e))
 
+    async def close(self):
+        await super(Bot, self).close()
+        await self.api_pool.close()
+
     def load_extensions(self):
         """Load all the extensions"""
         extension_module_name = f"{utils.get_project_name()}.cogs"
@@ -1,17 +1,19 @@
 import asyncio
-import concurrent.futures
+import collections
+import io
 import logging
-import os
 import random
 import re
+import zipfile
 
-import aiofiles
 import discord
 from discord.ext import commands
-from discord.ext.commands.cooldowns import BucketType
 
 from discord_bot.api import ori_randomizer
+from discord_bot.api import ratelimit
 from discord_bot import cfg
+from discord_bot import log
+from discord_bot import metrics
 from discord_bot import utils
 
 CONF = cfg.CONF
@@ -19,6 +21,232 @@ LOG = logging.getLogger('debug')
 
 SEED_FILENAME = "randomizer.dat"
 SPOILER_FILENAME = "spoiler.txt"
+ARCHIVE_FILENAME = "seeds.zip"
+
+DOWNLOAD_MESSAGE = "Downloading the seed..."
+
+# Bucket of the pool refills in the seed generation queue, the other buckets being guild or channel ids
+POOL_BUCKET = "pool"
+CANCEL_EMOJI = "\N{CROSS MARK}"
+
+
+def get_seed_header(data):
+    """Return the first line of the seed file, which describes its settings"""
+    return data['players'][0]['seed'].partition("\n")[0].rstrip("\r")
+
+
+def get_seed_archive(data_list):
+    """Compress the files of several seeds in a zip archive, each seed in its own folder
+
+    :return: The archive as a BytesIO
+    """
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as f:
+        for index, data in enumerate(data_list, 1):
+            f.writestr(f"seed_{index}/{SEED_FILENAME}", data['players'][0]['seed'])
+            f.writestr(f"seed_{index}/{SPOILER_FILENAME}", data['players'][0]['spoiler'])
+    archive.seek(0)
+    return archive
+
+
+class SeedGenJob:
+    """A seed generation waiting in the queue or running
+
+    :param bucket: The bucket of the job in the queue (e.g. the guild id)
+    :param coro_function: The coroutine function generating the seed
+    :param args: The arguments of the coroutine function
+    :param on_position_change: Function called with the new position of the job in the queue while it is waiting, and
+    with 0 once it is running. The position changes are reported at most every update interval of the queue.
+    """
+
+    def __init__(self, loop, bucket, coro_function, args, on_position_change=None):
+        self.bucket = bucket
+        self.coro_function = coro_function
+        self.args = args
+        self.on_position_change = on_position_change
+        self.position = 0
+        self.reported_position = 0
+        self.future = loop.create_future()
+        self.task = None
+
+    def report_position(self):
+        if self.position != self.reported_position and not self.future.done():
+            self.reported_position = self.position
+            if self.on_position_change:
+                self.on_position_change(self.position)
+
+
+class SeedGenQueue:
+    """Bot-wide queue of the seed generations
+
+    At most max_concurrent_jobs generations run at the same time, each being cancelled after timeout seconds. The
+    waiting jobs are served round-robin between the buckets (the guilds), so that a burst of requests in a guild
+    doesn't delay the requests of the other guilds.
+
+    The positions of the jobs are reported at most every update_interval seconds: a burst of requests in a channel
+    would otherwise edit every waiting message each time a job starts, hitting the rate limit of the channel.
+    """
+
+    def __init__(self, loop, max_concurrent_jobs, timeout, update_interval):
+        self.loop = loop
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.timeout = timeout
+        self.update_interval = update_interval
+        self.jobs_by_bucket = collections.OrderedDict()
+        self.running_jobs = set()
+        self.report_handle = None
+
+    def submit(self, bucket, coro_function, *args, on_position_change=None):
+        """Queue a seed generation
+
+        :return: The job, whose future gives the result of the generation
+        """
+        job = SeedGenJob(self.loop, bucket, coro_function, args, on_position_change)
+        self.jobs_by_bucket.setdefault(bucket, collections.deque()).append(job)
+        self._start_jobs()
+        return job
+
+    def cancel(self, job):
+        """Remove a waiting job from the queue or cancel a running job"""
+        if job.task:
+            job.task.cancel()
+            return
+
+        jobs = self.jobs_by_bucket.get(job.bucket)
+        if jobs and job in jobs:
+            jobs.remove(job)
+            if not jobs:
+                del self.jobs_by_bucket[job.bucket]
+            job.future.cancel()
+            self._update_positions()
+
+    def get_waiting_jobs(self):
+        """Return the waiting jobs in the order they will be started"""
+        queues = list(self.jobs_by_bucket.values())
+        waiting_jobs = []
+        for index in range(max([len(jobs) for jobs in queues], default=0)):
+            waiting_jobs += [jobs[index] for jobs in queues if index < len(jobs)]
+        return waiting_jobs
+
+    def _start_jobs(self):
+        while self.jobs_by_bucket and len(self.running_jobs) < self.max_concurrent_jobs:
+            bucket, jobs = self.jobs_by_bucket.popitem(last=False)
+            job = jobs.popleft()
+            if jobs:
+                # The other jobs of the bucket wait for a job of every other bucket
+                self.jobs_by_bucket[bucket] = jobs
+            if job.future.done():
+                # The caller stopped waiting for the result
+                continue
+            self.running_jobs.add(job)
+            job.task = asyncio.ensure_future(self._run(job), loop=self.loop)
+        self._update_positions()
+
+    def _update_positions(self):
+        for job in self.running_jobs:
+            job.position = 0
+        for position, job in enumerate(self.get_waiting_jobs(), 1):
+            job.position = position
+
+        if not self.report_handle:
+            self.report_handle = self.loop.call_later(self.update_interval, self._report_positions)
+
+    def _report_positions(self):
+        self.report_handle = None
+        for job in list(self.running_jobs) + self.get_waiting_jobs():
+            job.report_position()
+
+    async def _run(self, job):
+        try:
+            result = await asyncio.wait_for(job.coro_function(*job.args), self.timeout)
+        except asyncio.CancelledError:
+            job.future.cancel()
+        except Exception as e:
+            # The future is already cancelled if the caller stopped waiting for the result
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self.running_jobs.discard(job)
+            self._start_jobs()
+
+
+class SeedPool:
+    """Seeds generated in advance for the most requested settings
+
+    The requests are counted by settings (all the parameters but the seed). The settings_count most requested settings
+    have up to size seeds ready, the pool being refilled in the background as fast as the rate limiter allows.
+
+    :param generate: The coroutine function generating a random seed for given settings
+    :param rate_limiter: The ratelimit.TokenBucket limiting the generations of the pool
+    """
+
+    def __init__(self, loop, generate, size, settings_count, rate_limiter):
+        self.loop = loop
+        self.generate = generate
+        self.size = size
+        self.settings_count = settings_count
+        self.rate_limiter = rate_limiter
+        self.request_counts = collections.Counter()
+        self.seeds_by_settings = collections.defaultdict(collections.deque)
+        self.refill_needed = asyncio.Event(loop=loop)
+        self.refill_task = None
+
+        self.hits = 0
+        self.misses = 0
+        metrics.gauge("seedgen_pool_hits", "Number of seeds taken from the seed pool").set_function(lambda: self.hits)
+        metrics.gauge("seedgen_pool_misses", "Number of seeds requested while no seed was ready in the pool") \
+            .set_function(lambda: self.misses)
+        metrics.gauge("seedgen_pool_seeds", "Number of seeds ready in the seed pool") \
+            .set_function(lambda: sum([len(seeds) for seeds in self.seeds_by_settings.values()]))
+
+    def start(self):
+        if self.size:
+            self.refill_task = asyncio.ensure_future(self._refill(), loop=self.loop)
+
+    def stop(self):
+        if self.refill_task:
+            self.refill_task.cancel()
+            self.refill_task = None
+
+    def take(self, settings, count=1):
+        """Count a request and take the ready seeds for its settings
+
+        :param count: The number of seeds of the request, which is counted once whatever its number of seeds
+        :return: The list of the data of the taken seeds, at most count seeds
+        """
+        self.request_counts[settings] += 1
+        self.refill_needed.set()
+        seeds = self.seeds_by_settings.get(settings, [])
+        taken_seeds = [seeds.popleft() for _ in range(min(count, len(seeds)))]
+        self.hits += len(taken_seeds)
+        self.misses += count - len(taken_seeds)
+        return taken_seeds
+
+    def get_popular_settings(self):
+        return [settings for settings, _ in self.request_counts.most_common(self.settings_count)]
+
+    async def _refill(self):
+        while True:
+            await self.refill_needed.wait()
+            self.refill_needed.clear()
+
+            popular_settings = self.get_popular_settings()
+            for settings in set(self.seeds_by_settings) - set(popular_settings):
+                del self.seeds_by_settings[settings]
+
+            for settings in popular_settings:
+                while len(self.seeds_by_settings[settings]) < self.size:
+                    await self.rate_limiter.acquire()
+                    try:
+                        data = await self.generate(settings)
+                    except Exception as e:
+                        message = f"Cannot generate a seed for the pool with the settings {settings}"
+                        LOG.error(log.get_log_exception_message(message, e))
+                        break
+                    self.seeds_by_settings[settings].append(data)
 
 
 class OriRandoSeedGenCommands:
@@ -26,19 +254,50 @@ class OriRandoSeedGenCommands:
     def __init__(self, bot):
         type(self).__name__ = "Ori rando commands"
         self.bot = bot
-        self.client = ori_randomizer.OriRandomizerAPIClient()
-
-    async def _get_flags(self, filename):
-        """ Get the first line of the seed file
-
-        :param filename: the name of seed file
-        :return: The first line of the seed file as a string
-        """
-        async with aiofiles.open(filename) as f:
-            return await f.readline()
+        self.client = ori_randomizer.OriRandomizerAPIClient(self.bot.api_pool)
+        self.queue = SeedGenQueue(self.bot.loop, CONF.SEEDGEN_MAX_CONCURRENT_JOBS, CONF.SEEDGEN_TIMEOUT,
+                                  CONF.SEEDGEN_QUEUE_UPDATE_INTERVAL)
+
+        # The queued jobs by id of their download message {<message_id>: ([<job>, ...], <requester id>)}
+        self.jobs_by_message_id = {}
+
+        rate_limiter = ratelimit.TokenBucket(CONF.SEEDGEN_POOL_RATE_LIMIT, CONF.SEEDGEN_POOL_RATE_LIMIT_PERIOD)
+        self.pool = SeedPool(self.bot.loop, self._generate_random_seed, CONF.SEEDGEN_POOL_SIZE,
+                             CONF.SEEDGEN_POOL_SETTINGS_COUNT, rate_limiter)
+        self.pool.start()
+
+    def __unload(self):
+        self.pool.stop()
+        for jobs, _ in self.jobs_by_message_id.values():
+            for job in jobs:
+                self.queue.cancel(job)
+        asyncio.ensure_future(self.client.close(), loop=self.bot.loop)
+
+    async def _get_data(self, seed, settings, cache=False):
+        preset, key_mode, path_diff, variations, logic_paths, flags = settings
+        return await self.client.get_data(seed, preset, key_mode, path_diff, list(variations), list(logic_paths),
+                                          list(flags), cache=cache)
+
+    async def _generate_random_seed(self, settings):
+        # The refills go through the queue to count against SEEDGEN_MAX_CONCURRENT_JOBS, served in turn with the guilds
+        job = self.queue.submit(POOL_BUCKET, self._get_data, str(random.randint(1, 1000000000)), settings)
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            self.queue.cancel(job)
+            raise
+
+    async def _edit_download_message(self, message, position):
+        content = DOWNLOAD_MESSAGE
+        if position:
+            content += f" (position in the queue: {position})"
+        try:
+            await message.edit(content=content)
+        except discord.HTTPException:
+            # The message has been deleted once the seed was sent
+            pass
 
     @commands.command()
-    @commands.cooldown(1, CONF.SEEDGEN_COOLDOWN, BucketType.guild)
     async def seed(self, ctx, *args):
         """Generate a seed for the Ori randomizer
 
@@ -53,6 +312,8 @@ class OriRandoSeedGenCommands:
         - variations: forcetrees, entrance, hard, starved, ohko, nonprogressmapstones, 0xp, noplants, noteleporters
 
         - flags: tracking, verbose_paths, classic_gen, hard-path, easy-path
+
+        - count: x2, x3... to generate several seeds with the same settings, sent in a zip archive
         """
 
         author_name = ctx.author.nick or ctx.author.name
@@ -60,10 +321,20 @@ class OriRandoSeedGenCommands:
 
         seed_codes = re.findall('[^"]*"(.*)"', ctx.message.content)
         LOG.debug(f"Valid seed codes found: {seed_codes}")
-        seed = seed_codes[0] if seed_codes else str(random.randint(1, 1000000000))
-
         args = [arg.lower() for arg in args]
 
+        counts = [int(arg[1:]) for arg in args if re.fullmatch(r"x\d+", arg)]
+        count = min(max(counts[0], 1), CONF.SEEDGEN_MAX_BATCH_SIZE) if counts else 1
+        LOG.debug(f"Number of seeds: {count}")
+
+        # The seeds of a batch with a seed code are numbered to be reproducible
+        if seed_codes and count > 1:
+            seeds = [f"{seed_codes[0]}-{index}" for index in range(1, count + 1)]
+        elif seed_codes:
+            seeds = [seed_codes[0]]
+        else:
+            seeds = [str(random.randint(1, 1000000000)) for _ in range(count)]
+
         def get_matching(name, target_list):
             matching_vals = [arg for arg in args if arg in target_list]
             LOG.debug(f"Valid {name} found: {matching_vals}")
@@ -96,57 +367,101 @@ class OriRandoSeedGenCommands:
         logic_preset = logic_presets[0] if logic_presets else 'standard'
         key_mode = key_modes[0] if key_modes else None
 
-        download_message = await self.bot.send(ctx.channel, "Downloading the seed...")
-        try:
-
-            # Limit the executor to 1 worker to make everything sequential
-            executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        settings = (logic_preset, key_mode, path_diff, tuple(sorted(variations)), tuple(sorted(logic_paths)),
+                    tuple(sorted(flags)))
 
-            # Download the seed data
-            LOG.debug("Downloading the seed data...")
-            data = await self.client.get_data(seed, logic_preset, key_mode, path_diff, variations, logic_paths, flags)
-
-            # Create a temporary subfolder to avoid any name conflict
-            LOG.debug("Creating the subfolder...")
-            self.bot.loop.run_in_executor(executor, os.makedirs, seed)
-
-            seed_path = f"{seed}/{SEED_FILENAME}"
-            spoiler_path = f"{seed}/{SPOILER_FILENAME}"
-
-            LOG.debug(f"Creating '{seed_path}' and '{spoiler_path}'...")
-            file_futures = {
-                utils.write_file(seed_path, data['players'][0]['seed']),
-                utils.write_file(spoiler_path, data['players'][0]['spoiler'])
-            }
-            await asyncio.gather(*file_futures, loop=self.bot.loop)
+        download_message = await self.bot.send(ctx.channel, DOWNLOAD_MESSAGE)
+        try:
 
-            # Send the files in the chat
+            # The random seeds are taken from the pool if they are ready (a new game is created for each tracked seed)
+            data_list = [None] * count
+            if not seed_codes and "tracking" not in flags:
+                pooled_data = self.pool.take(settings, count)
+                data_list[:len(pooled_data)] = pooled_data
+
+            # The other seeds are downloaded, the generations are queued between all the guilds, one job per seed
+            missing_indexes = [index for index, data in enumerate(data_list) if data is None]
+            if missing_indexes:
+                def on_position_change(position):
+                    asyncio.ensure_future(self._edit_download_message(download_message, position), loop=self.bot.loop)
+
+                LOG.debug("Downloading the seed data...")
+                bucket = ctx.guild.id if ctx.guild else ctx.channel.id
+                # The download message shows the position of the first seed of the batch
+                jobs = [self.queue.submit(bucket, self._get_data, seeds[index], settings, bool(seed_codes))
+                        for index in missing_indexes]
+                jobs[0].on_position_change = on_position_change
+                self.jobs_by_message_id[download_message.id] = (jobs, ctx.author.id)
+                await download_message.add_reaction(CANCEL_EMOJI)
+                try:
+                    results = await asyncio.gather(*[job.future for job in jobs], return_exceptions=True)
+                finally:
+                    del self.jobs_by_message_id[download_message.id]
+
+                # The seeds which have been generated are sent even if the others failed
+                errors = [result for result in results if isinstance(result, BaseException)]
+                if len(errors) == len(results) == count:
+                    raise errors[0]
+                for index, result in zip(missing_indexes, results):
+                    if not isinstance(result, BaseException):
+                        data_list[index] = result
+                for error in errors:
+                    LOG.error(log.get_log_exception_message("A seed of the batch couldn't be generated", error))
+
+            # Send the files in the chat, straight from memory
             LOG.debug("Sending the files in Discord...")
-            seed_header = await self._get_flags(seed_path)
-            message = f"Seed requested by **{author_name}**\n" \
-
-            if "tracking" in flags:
-                message += f"**Map**: {CONF.SEEDGEN_API_URL + data['map_url']}\n"
-                message += f"**History**: {CONF.SEEDGEN_API_URL + data['history_url']}\n"
-
-            message += f"`{seed_header}`"
+            message = f"{'Seeds' if count > 1 else 'Seed'} requested by **{author_name}**\n"
+            for index, data in enumerate(data_list, 1):
+                if data is None:
+                    message += f"{index}. The seed couldn't be generated\n"
+                    continue
+                if "tracking" in flags:
+                    message += f"**Map**: {CONF.SEEDGEN_API_URL + data['map_url']}\n"
+                    message += f"**History**: {CONF.SEEDGEN_API_URL + data['history_url']}\n"
+                message += f"{index}. " if count > 1 else ""
+                message += f"`{get_seed_header(data)}`\n"
+
+            if count > 1:
+                files = [discord.File(get_seed_archive([data for data in data_list if data is not None]),
+                                      filename=ARCHIVE_FILENAME)]
+            else:
+                files = [
+                    discord.File(io.BytesIO(data_list[0]['players'][0]['seed'].encode()), filename=SEED_FILENAME),
+                    discord.File(io.BytesIO(data_list[0]['players'][0]['spoiler'].encode()), filename=SPOILER_FILENAME)
+                ]
 
             await download_message.delete()
-            await self.bot.send(ctx.channel, message,
-                                files=[discord.File(seed_path), discord.File(spoiler_path)])
+            await self.bot.send(ctx.channel, message, files=files)
             LOG.debug(f"The files have correctly been sent in Discord")
 
-            # Delete everything once it's sent
-            self.bot.loop.run_in_executor(executor, os.remove, seed_path)
-            self.bot.loop.run_in_executor(executor, os.remove, spoiler_path)
-            self.bot.loop.run_in_executor(executor, os.rmdir, seed)
-            LOG.debug(f"Cleanup successful")
+        except asyncio.CancelledError:
+            LOG.debug(f"The seed requested by {author_name} has been cancelled")
+            await download_message.delete()
+
+        except asyncio.TimeoutError:
+            error_message = f"The seed generation took more than {CONF.SEEDGEN_TIMEOUT} seconds"
+            LOG.error(error_message)
+            await download_message.edit(content=f"```{error_message}. Please try again later.```")
 
         except:
             error_message = "An error has occured while generating the seed"
             LOG.exception(error_message)
             await download_message.edit(content=f"```{error_message}. Please try again later.```")
 
+    async def on_raw_reaction_add(self, payload):
+        """Cancel a seed generation when its requester (or an admin) reacts with the cancel emoji"""
+        if payload.emoji.name != CANCEL_EMOJI or payload.message_id not in self.jobs_by_message_id:
+            return
+        if payload.user_id == self.bot.user.id:
+            return
+
+        jobs, requester_id = self.jobs_by_message_id[payload.message_id]
+        guild = getattr(self.bot.get_channel(payload.channel_id), "guild", None)
+        user = guild.get_member(payload.user_id) if guild else None
+        if payload.user_id == requester_id or (user and utils.is_admin(user)):
+            for job in jobs:
+                self.queue.cancel(job)
+
 
 def setup(bot):
     ori_rando_seedgen_commands = OriRandoSeedGenCommands(bot)
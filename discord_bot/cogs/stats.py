@@ -0,0 +1,52 @@
+import asyncio
+import logging
+
+from aiohttp import web
+from discord.ext import commands
+
+from discord_bot import cfg
+from discord_bot import log
+from discord_bot import metrics
+from discord_bot import utils
+
+CONF = cfg.CONF
+LOG = logging.getLogger('debug')
+
+
+class StatsCommands:
+
+    def __init__(self, bot):
+        type(self).__name__ = "Stats commands"
+        self.bot = bot
+        self.runner = None
+
+        if CONF.METRICS_PORT:
+            asyncio.ensure_future(self.start_server(), loop=self.bot.loop)
+
+    async def start_server(self):
+        """Expose the metrics in the Prometheus format on http://METRICS_HOST:METRICS_PORT/metrics"""
+        app = web.Application()
+        app.router.add_get("/metrics", self.get_metrics)
+        self.runner = web.AppRunner(app)
+        try:
+            await self.runner.setup()
+            await web.TCPSite(self.runner, CONF.METRICS_HOST, CONF.METRICS_PORT).start()
+            LOG.debug(f"The metrics are exposed on {CONF.METRICS_HOST}:{CONF.METRICS_PORT}/metrics")
+        except Exception as e:
+            message = "Cannot start the metrics server"
+            LOG.exception(log.get_log_exception_message(message, e))
+
+    async def get_metrics(self, request):
+        return web.Response(text=metrics.render(), content_type="text/plain")
+
+    @commands.command()
+    @commands.check(utils.check_is_admin)
+    async def stats(self, ctx):
+        """Display the bot metrics"""
+        lines = [f"{metric.name}: {metric.summary()}" for metric in metrics.REGISTRY]
+        await self.bot.send(ctx.channel, "\n".join(lines), code_block=True)
+
+
+def setup(bot):
+    stats_commands = StatsCommands(bot)
+    bot.add_cog(stats_commands)
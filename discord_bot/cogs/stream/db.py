@@ -3,6 +3,7 @@ import logging
 
 from asyncpg import exceptions as db_exc
 from gino import Gino
+from sqlalchemy.dialects import postgresql
 
 from discord_bot import cfg
 from discord_bot import log
@@ -39,6 +40,10 @@ class Stream(BaseModel, db.Model):
     id = db.Column(db.BigInteger(), primary_key=True)
     name = db.Column(db.Unicode(), nullable=False)
 
+    # Activity of the stream used to schedule its polls (see scheduler.PollScheduler)
+    last_online_date = db.Column(db.DateTime())
+    go_live_minutes = db.Column(postgresql.ARRAY(db.Integer()))
+
     @property
     def offline_duration(self):
         now = datetime.now()
@@ -52,76 +57,329 @@ class Stream(BaseModel, db.Model):
         self.last_offline_date = None
         self.notifications = []
 
+        # Fingerprint of the notified fields (see embeds.get_fingerprint) and the last change not notified yet
+        self.fingerprint = None
+        self.pending_fingerprint = None
+        self.pending_fingerprint_date = None
+
 
 class ChannelStream(BaseModel, db.Model):
 
     __tablename__ = "channels_streams"
-    __table_args__ = (db.UniqueConstraint("stream_id", "channel_id"),)
+    __table_args__ = (db.UniqueConstraint("stream_id", "channel_id"),
+                      db.Index("ix_channels_streams_stream_id", "stream_id"))
 
     channel_id = db.Column(db.BigInteger(), db.ForeignKey('channels.id'), primary_key=True)
     stream_id = db.Column(db.BigInteger(), db.ForeignKey('streams.id'), primary_key=True)
     everyone = db.Column(db.Boolean(), default=False)
 
 
+class Notification(BaseModel, db.Model):
+    """A notification message sent for a stream which is still online"""
+
+    __tablename__ = "notifications"
+
+    message_id = db.Column(db.BigInteger(), primary_key=True)
+    channel_id = db.Column(db.BigInteger(), nullable=False)
+    stream_id = db.Column(db.BigInteger(), nullable=False)
+
+    def __init__(self, **kwargs):
+        super(Notification, self).__init__(**kwargs)
+        self.message = None
+
+
+class SubscriptionIndex:
+    """In-memory write-through index of the channels_streams table
+
+    {
+      <stream_id_1>: {<channel_id_1>: everyone, <channel_id_2>: everyone, ...}
+      <stream_id_2>: {<channel_id_2>: everyone, <channel_id_3>: everyone, ...}
+    }
+    {
+      <channel_id_1>: {<stream_id_1>, <stream_id_2>, ...}
+      <channel_id_2>: {<stream_id_2>, <stream_id_3>, ...}
+    }
+    """
+
+    def __init__(self):
+        self.channels_by_stream_id = {}
+        self.streams_by_channel_id = {}
+
+        # Incremented on every change, to invalidate the data computed from the index
+        self.version = 0
+
+    def __contains__(self, key):
+        channel_id, stream_id = key
+        return channel_id in self.channels_by_stream_id.get(stream_id, {})
+
+    def load(self, channel_streams):
+        self.channels_by_stream_id = {}
+        self.streams_by_channel_id = {}
+        for cs in channel_streams:
+            self.add(cs.channel_id, cs.stream_id, cs.everyone)
+
+    def add(self, channel_id, stream_id, everyone=False):
+        self.version += 1
+        self.channels_by_stream_id.setdefault(stream_id, {})[channel_id] = everyone
+        self.streams_by_channel_id.setdefault(channel_id, set()).add(stream_id)
+
+    def remove(self, channel_id, stream_id):
+        self.version += 1
+        channels = self.channels_by_stream_id.get(stream_id, {})
+        channels.pop(channel_id, None)
+        if not channels:
+            self.channels_by_stream_id.pop(stream_id, None)
+
+        streams = self.streams_by_channel_id.get(channel_id, set())
+        streams.discard(stream_id)
+        if not streams:
+            self.streams_by_channel_id.pop(channel_id, None)
+
+    def get_channels(self, stream_id):
+        """Return {<channel_id>: everyone} for the channels in which the stream is tracked"""
+        return self.channels_by_stream_id.get(stream_id, {})
+
+    def get_streams(self, channel_id):
+        """Return the set of stream ids tracked in the channel"""
+        return self.streams_by_channel_id.get(channel_id, set())
+
+
 class DBDriver:
 
     def __init__(self):
         self.engine = None
         self.ready = False
+        self.subscriptions = SubscriptionIndex()
+        self.added_notifications = []
+        self.removed_notification_ids = set()
+        self.flush_failures = 0
+        self.active_streams = {}
 
     async def setup(self):
         bind = f"postgresql://{CONF.DB_USER}:{CONF.DB_PASSWORD}@{CONF.DB_HOST}:{CONF.DB_PORT}/{CONF.DB_NAME}"
         await db.set_bind(bind)
         await db.gino.create_all()
-        self.ready = True
 
-    async def _create(self, model, **kwargs):
-        try:
-            return await model.create(**kwargs)
-        except (KeyError, db_exc.UniqueViolationError) as e:
-            message = f"Cannot create {model.__name__}"
-            LOG.error(log.get_log_exception_message(message, e))
+        # create_all skips the indexes and the columns of the tables which already exist
+        await db.status(db.text("CREATE INDEX IF NOT EXISTS ix_channels_streams_stream_id "
+                                "ON channels_streams (stream_id)"))
+        await db.status(db.text("ALTER TABLE streams ADD COLUMN IF NOT EXISTS last_online_date TIMESTAMP"))
+        await db.status(db.text("ALTER TABLE streams ADD COLUMN IF NOT EXISTS go_live_minutes INTEGER[]"))
+
+        self.subscriptions.load(await ChannelStream.query.gino.all())
+        self.ready = True
 
     # CREATE
 
-    async def create_channel(self, id, name, guild_id, guild_name):
-        params = {'id': id, 'name': name, 'guild_id': guild_id, 'guild_name': guild_name}
-        return await self._create(Channel, **params)
+    async def create_channel_streams(self, channel, subscriptions):
+        """Track several streams in a discord channel in a single transaction
+
+        The streams and the channel are created if they don't exist, the streams already tracked in the channel are
+        ignored.
+
+        :param channel: The discord channel
+        :param subscriptions: [(<stream_id>, <stream_name>, <everyone>), ...]
+        :return: The list of stream ids newly tracked in the channel
+        """
+        streams = [{'id': stream_id, 'name': stream_name} for stream_id, stream_name, _ in subscriptions]
+        channel_streams = [{'channel_id': channel.id, 'stream_id': stream_id, 'everyone': everyone}
+                           for stream_id, _, everyone in subscriptions]
 
-    async def create_stream(self, id, name):
-        params = {'id': id, 'name': name}
-        return await self._create(Stream, **params)
+        async with db.transaction():
+            await db.status(postgresql.insert(Stream.__table__).values(streams).on_conflict_do_nothing())
+            await db.status(postgresql.insert(Channel.__table__).values(
+                id=channel.id, name=channel.name, guild_id=channel.guild.id, guild_name=channel.guild.name
+            ).on_conflict_do_nothing())
+            query = postgresql.insert(ChannelStream.__table__).values(channel_streams).on_conflict_do_nothing()
+            rows = await db.all(query.returning(ChannelStream.stream_id, ChannelStream.everyone))
 
-    async def create_channel_stream(self, channel_id, stream_id, everyone=False):
-        params = {'channel_id': channel_id, 'stream_id': stream_id, 'everyone': everyone}
-        return await self._create(ChannelStream, **params)
+        for stream_id, everyone in rows:
+            self.subscriptions.add(channel.id, stream_id, everyone)
+        return [stream_id for stream_id, _ in rows]
 
     # READ
 
+    @staticmethod
+    def _get_query(model, **kwargs):
+        """Build a query filtered in SQL, the parameters whose value is None are ignored
+
+        :param model: The queried model
+        :param kwargs: {<column name>: <value>}
+        :return: The query
+        """
+        query = model.query
+        for column, value in kwargs.items():
+            if value:
+                query = query.where(getattr(model, column) == value)
+        return query
+
+    async def _get(self, model, **kwargs):
+        return await self._get_query(model, **kwargs).gino.all()
+
+    async def _exists(self, model, **kwargs):
+        """Check if a row exists without loading it
+
+        :param model: The queried model
+        :param kwargs: {<column name>: <value>}
+        :return: True if at least one row matches the parameters
+        """
+        return await db.scalar(db.exists(self._get_query(model, **kwargs)).select())
+
     async def get_channel(self, id=None, name=None, guild_id=None, guild_name=None):
-        query = Channel.query
-        if id:
-            query = query.where(Channel.id == id)
-        if name:
-            query = query.where(Channel.name == name)
-        if guild_id:
-            query = query.where(Channel.guild_id == guild_id)
-        if guild_name:
-            query = query.where(Channel.guild_name == guild_name)
-        return await query.gino.all()
+        return await self._get(Channel, id=id, name=name, guild_id=guild_id, guild_name=guild_name)
 
     async def get_stream(self, id=None, name=None):
-        query = Stream.query
-        if id:
-            query = query.where(Stream.id == id)
-        if name:
-            query = query.where(Stream.name == name)
-        return await query.gino.all()
+        return await self._get(Stream, id=id, name=name)
 
     async def get_channel_stream(self, channel_id=None, stream_id=None):
-        channel_streams = await ChannelStream.query.gino.all()
-        if channel_id:
-            channel_streams = [cs for cs in channel_streams if cs.channel_id == channel_id]
-        if stream_id:
-            channel_streams = [cs for cs in channel_streams if cs.stream_id == stream_id]
-        return channel_streams
+        return await self._get(ChannelStream, channel_id=channel_id, stream_id=stream_id)
+
+    async def get_notification(self, stream_ids=None):
+        query = Notification.query
+        if stream_ids is not None:
+            query = query.where(Notification.stream_id.in_(stream_ids))
+        return await query.gino.all()
+
+    async def has_channel(self, id=None, name=None, guild_id=None, guild_name=None):
+        return await self._exists(Channel, id=id, name=name, guild_id=guild_id, guild_name=guild_name)
+
+    async def has_stream(self, id=None, name=None):
+        return await self._exists(Stream, id=id, name=name)
+
+    async def has_channel_stream(self, channel_id=None, stream_id=None):
+        return await self._exists(ChannelStream, channel_id=channel_id, stream_id=stream_id)
+
+    # DELETE
+
+    async def delete_channel(self, id):
+        await Channel.delete.where(Channel.id == id).gino.status()
+
+    async def delete_stream(self, id):
+        async with db.transaction():
+            await Notification.delete.where(Notification.stream_id == id).gino.status()
+            await Stream.delete.where(Stream.id == id).gino.status()
+
+    async def delete_channel_stream(self, channel_id, stream_id):
+        query = ChannelStream.delete.where(ChannelStream.channel_id == channel_id)
+        await query.where(ChannelStream.stream_id == stream_id).gino.status()
+        self.subscriptions.remove(channel_id, stream_id)
+
+    async def purge_channel(self, channel_id):
+        """Delete a channel, its subscriptions, its notifications and the streams which are not tracked in any other
+        channel, in a single transaction
+
+        :param channel_id: The discord channel id
+        :return: The ids of the streams untracked from the channel and the ids of the deleted streams
+        """
+        async with db.transaction():
+            query = ChannelStream.delete.where(ChannelStream.channel_id == channel_id)
+            stream_ids = [row[0] for row in await db.all(query.returning(ChannelStream.stream_id))]
+
+            is_tracked = db.exists().where(ChannelStream.stream_id == Stream.id).correlate(Stream.__table__)
+            query = Stream.delete.where(Stream.id.in_(stream_ids)).where(~is_tracked)
+            deleted_stream_ids = [row[0] for row in await db.all(query.returning(Stream.id))]
+
+            query = Notification.delete.where(db.or_(Notification.channel_id == channel_id,
+                                                     Notification.stream_id.in_(deleted_stream_ids)))
+            await query.gino.status()
+            await Channel.delete.where(Channel.id == channel_id).gino.status()
+
+        for stream_id in stream_ids:
+            self.subscriptions.remove(channel_id, stream_id)
+        self.added_notifications = [notification for notification in self.added_notifications
+                                    if notification.channel_id != channel_id]
+        return stream_ids, deleted_stream_ids
+
+    # NOTIFICATIONS
+    # The notifications are written by batch: the changes are queued then written in a single transaction by
+    # flush_notifications
+
+    def add_notification(self, notification):
+        self.added_notifications.append(notification)
+
+    def remove_notification(self, notification):
+        self.removed_notification_ids.add(notification.message_id)
+
+    async def flush_notifications(self):
+        """Write the queued notification changes in a single transaction
+
+        If the batch contains an invalid change (e.g. a duplicate notification), the changes are written one by one and
+        the invalid ones are dropped. After another error, the batch is retried during the next flushes, then dropped
+        after NOTIFICATION_FLUSH_MAX_RETRIES failures.
+        """
+        added_notifications, self.added_notifications = self.added_notifications, []
+        removed_notification_ids, self.removed_notification_ids = self.removed_notification_ids, set()
+        if not added_notifications and not removed_notification_ids:
+            return
+
+        try:
+            async with db.transaction():
+                await self._write_notifications(added_notifications, removed_notification_ids)
+        except (db_exc.IntegrityConstraintViolationError, db_exc.DataError) as e:
+            message = "Invalid notification changes, writing them one by one"
+            LOG.error(log.get_log_exception_message(message, e))
+            self.flush_failures = 0
+            await self._write_notifications_one_by_one(added_notifications, removed_notification_ids)
+        except Exception as e:
+            self.flush_failures += 1
+            if self.flush_failures > CONF.NOTIFICATION_FLUSH_MAX_RETRIES:
+                message = f"Cannot write the notifications in the database, {len(added_notifications)} added and " \
+                          f"{len(removed_notification_ids)} removed notifications are dropped"
+                self.flush_failures = 0
+            else:
+                # Keep the changes to write them during the next flush
+                self.added_notifications = added_notifications + self.added_notifications
+                self.removed_notification_ids |= removed_notification_ids
+                message = "Cannot write the notifications in the database"
+            LOG.error(log.get_log_exception_message(message, e))
+        else:
+            self.flush_failures = 0
+            LOG.debug(f"{len(added_notifications)} notifications added and {len(removed_notification_ids)} "
+                      f"notifications removed in the database")
+
+    @staticmethod
+    async def _write_notifications(added_notifications, removed_notification_ids):
+        if added_notifications:
+            values = [notification.to_dict() for notification in added_notifications]
+            await Notification.insert().values(values).gino.status()
+        if removed_notification_ids:
+            query = Notification.delete.where(Notification.message_id.in_(removed_notification_ids))
+            await query.gino.status()
+
+    async def _write_notifications_one_by_one(self, added_notifications, removed_notification_ids):
+        changes = [([notification], set()) for notification in added_notifications] + \
+                  [([], {message_id}) for message_id in removed_notification_ids]
+        for change in changes:
+            try:
+                await self._write_notifications(*change)
+            except Exception as e:
+                message = f"The notification change {change} is dropped"
+                LOG.error(log.get_log_exception_message(message, e))
+
+    # STREAM ACTIVITY
+    # The activity is written by batch along with the notifications
+
+    def update_stream_activity(self, stream):
+        """Queue the write of the activity of a stream (see flush_stream_activity)"""
+        self.active_streams[stream.id] = stream
+
+    async def flush_stream_activity(self):
+        """Write the queued activity of the streams in a single transaction
+
+        After an error, the activity is written during the next flushes, the queue only keeping the last activity of
+        each stream.
+        """
+        active_streams, self.active_streams = self.active_streams, {}
+        if not active_streams:
+            return
+
+        try:
+            async with db.transaction():
+                for stream in active_streams.values():
+                    query = Stream.update.values(last_online_date=stream.last_online_date,
+                                                 go_live_minutes=stream.go_live_minutes)
+                    await query.where(Stream.id == stream.id).gino.status()
+        except Exception as e:
+            self.active_streams = {**active_streams, **self.active_streams}
+            message = "Cannot write the activity of the streams in the database"
+            LOG.error(log.get_log_exception_message(message, e))
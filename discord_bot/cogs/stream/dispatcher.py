@@ -0,0 +1,84 @@
+import asyncio
+import heapq
+import itertools
+import logging
+
+from discord_bot import log
+
+LOG = logging.getLogger('debug')
+
+# Job priorities, the lowest value is processed first
+NOTIFICATION = 0
+REACTION = 1
+EDITION = 2
+
+
+class NotificationDispatcher:
+    """Deliver the stream notifications in the background
+
+    The jobs are processed by a bounded number of workers, in priority order then in submission order.
+    Discord rate-limits the requests by bucket (e.g. the messages or the reactions of a channel), so the jobs of a same
+    bucket are run one at a time while the jobs of different buckets are run concurrently. A worker doesn't wait for a
+    busy bucket: the job is set aside until the running job of its bucket is done, and the worker takes the next job.
+    """
+
+    def __init__(self, loop, max_concurrent_jobs):
+        self.loop = loop
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.queue = asyncio.PriorityQueue()
+        self.counter = itertools.count()
+        self.busy_buckets = set()
+        self.pending_jobs_by_bucket = {}
+        self.workers = []
+
+    def start(self):
+        if not self.workers:
+            self.workers = [asyncio.ensure_future(self._work(), loop=self.loop)
+                            for _ in range(self.max_concurrent_jobs)]
+
+    def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+
+    def get_size(self):
+        """Return the number of jobs waiting, including the jobs of the busy buckets"""
+        return self.queue.qsize() + sum([len(jobs) for jobs in self.pending_jobs_by_bucket.values()])
+
+    def submit(self, priority, bucket, coro_function, *args):
+        """Queue a job without waiting for it to be processed
+
+        :param priority: NOTIFICATION, REACTION or EDITION
+        :param bucket: The discord rate-limit bucket of the job, e.g. ("messages", <channel_id>)
+        :param coro_function: The coroutine function to run
+        :param args: The arguments of the coroutine function
+        """
+        # The counter keeps the submission order between the jobs of a same priority
+        self.queue.put_nowait((priority, next(self.counter), bucket, coro_function, args))
+
+    async def _work(self):
+        while True:
+            job = await self.queue.get()
+            priority, _, bucket, coro_function, args = job
+            if bucket in self.busy_buckets:
+                # The job is queued again, in priority order, once the running job of its bucket is done
+                heapq.heappush(self.pending_jobs_by_bucket.setdefault(bucket, []), job)
+                self.queue.task_done()
+                continue
+
+            self.busy_buckets.add(bucket)
+            try:
+                await coro_function(*args)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                message = f"The job {coro_function.__name__} (bucket={bucket}) has failed"
+                LOG.exception(log.get_log_exception_message(message, e))
+            finally:
+                self.busy_buckets.discard(bucket)
+                pending_jobs = self.pending_jobs_by_bucket.get(bucket)
+                if pending_jobs:
+                    self.queue.put_nowait(heapq.heappop(pending_jobs))
+                    if not pending_jobs:
+                        del self.pending_jobs_by_bucket[bucket]
+                self.queue.task_done()
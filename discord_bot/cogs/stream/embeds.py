@@ -2,6 +2,12 @@ from discord import colour, embeds
 
 TWITCH_ICON_URL = "https://www.shareicon.net/download/2015/09/08/98061_twitch_512x512.png"
 
+# Discord embed limits (the total length is lower than the 6000 characters limit to leave room for the author and the
+# footer)
+MAX_FIELDS = 25
+MAX_FIELD_VALUE_LENGTH = 1024
+MAX_PAGE_LENGTH = 5500
+
 
 def get_field(embed, field_name):
     fields = [field for field in embed.fields if field.name == field_name]
@@ -27,6 +33,15 @@ def get_notification(status, everyone=False):
     return message, embed
 
 
+def get_fingerprint(status):
+    """Return a compact value identifying the fields of a notification which can change while the stream is live
+
+    :param status: stream status
+    :return: hash of the title, the game and the broadcast type
+    """
+    return hash((status['channel']['status'], status['game'], status['stream_type']))
+
+
 def get_offline_embed(embed):
     embed.colour = colour.Color.lighter_grey()
     return embed
@@ -90,8 +105,11 @@ def _get_notification_embed(data, broadcast_type, color, *fields, url=None,
     return embed
 
 
-def get_stream_list_embed(streams_by_channel):
-    """Build the embed to return on !stream list call
+def get_stream_list_embeds(streams_by_channel):
+    """Build the pages of embeds to return on !stream list call
+
+    The streams of a channel are split in several fields if they don't fit in one, and the fields are split in
+    several embeds to respect the Discord embed limits.
 
     :param streams_by_channel: dictionary
     {
@@ -99,11 +117,36 @@ def get_stream_list_embed(streams_by_channel):
       <discord_channel_2>: ["stream_name_2", "stream_name_3", ...]
       <discord_channel_3>: ["stream_name_1", "stream_name_3", ...]
     }
-    :return: embed with the list of stream for each channel
+    :return: list of embeds with the list of stream for each channel
     """
-    embed = embeds.Embed()
-    embed.set_author(name="Streams", icon_url=TWITCH_ICON_URL)
+    fields = []
     for channel, streams in sorted(streams_by_channel.items(), key=lambda x: x[0].position):
         stream_links = [f"[{stream}](https://twitch.tv/{stream})" for stream in sorted(streams)]
-        embed.add_field(name=channel.name, value=", ".join(stream_links), inline=False)
-    return embed
+        value = ""
+        for stream_link in stream_links:
+            if value and len(value) + len(", ") + len(stream_link) > MAX_FIELD_VALUE_LENGTH:
+                fields.append((channel.name, value))
+                value = ""
+            value = f"{value}, {stream_link}" if value else stream_link
+        fields.append((channel.name, value))
+
+    pages = [[]]
+    page_length = 0
+    for name, value in fields:
+        field_length = len(name) + len(value)
+        if len(pages[-1]) == MAX_FIELDS or page_length + field_length > MAX_PAGE_LENGTH:
+            pages.append([])
+            page_length = 0
+        pages[-1].append((name, value))
+        page_length += field_length
+
+    stream_list_embeds = []
+    for index, page in enumerate(pages, 1):
+        embed = embeds.Embed()
+        embed.set_author(name="Streams", icon_url=TWITCH_ICON_URL)
+        for name, value in page:
+            embed.add_field(name=name, value=value, inline=False)
+        if len(pages) > 1:
+            embed.set_footer(text=f"Page {index}/{len(pages)}")
+        stream_list_embeds.append(embed)
+    return stream_list_embeds
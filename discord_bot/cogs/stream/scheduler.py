@@ -0,0 +1,125 @@
+from datetime import datetime
+import logging
+import math
+import time
+
+from discord_bot import cfg
+
+CONF = cfg.CONF
+LOG = logging.getLogger('debug')
+
+# Number of go-live dates kept for each stream
+GO_LIVE_HISTORY_SIZE = 10
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class PollScheduler:
+    """Decide when each tracked stream has to be polled
+
+    Each stream has its own poll interval:
+    - POLL_MIN_INTERVAL if the stream is online, in the MIN_OFFLINE_DURATION grace window, or close to the time of the
+      day it usually goes live
+    - POLL_MAX_INTERVAL if the stream hasn't been online for POLL_DORMANT_DURATION
+    - POLL_INTERVAL otherwise
+
+    The streams whose events are pushed by the webhook are only polled every WEBHOOK_RECONCILIATION_INTERVAL seconds
+    (POLL_MAX_INTERVAL while they are online to update their notifications), except during the grace window.
+
+    The streams which are due are packed with the next streams to poll so that every API call is full. The activity of
+    the streams (last online date and go-live times) is stored with the streams, to survive the restarts.
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.next_poll_dates = {}
+        self.pushed_stream_ids = set()
+
+    def sync(self, stream_ids):
+        """Add the new tracked streams (polled as soon as possible) and forget the streams which are not tracked
+
+        :param stream_ids: The tracked stream ids
+        """
+        stream_ids = set(stream_ids)
+        now = time.monotonic()
+        for stream_id in stream_ids - set(self.next_poll_dates):
+            self.next_poll_dates[stream_id] = now
+        for stream_id in set(self.next_poll_dates) - stream_ids:
+            del self.next_poll_dates[stream_id]
+
+    def get_due_streams(self):
+        """Return the streams to poll now
+
+        The streams which are due are completed by the next streams to poll until the last batch is full.
+
+        :return: The list of stream ids to poll
+        """
+        now = time.monotonic()
+        stream_ids = sorted(self.next_poll_dates, key=self.next_poll_dates.get)
+        due_count = len([stream_id for stream_id in stream_ids if self.next_poll_dates[stream_id] <= now])
+        if not due_count:
+            return []
+        batch_count = math.ceil(due_count / self.batch_size)
+        return stream_ids[:batch_count * self.batch_size]
+
+    def get_sleep_duration(self):
+        """Return the number of seconds until the next stream is due"""
+        if not self.next_poll_dates:
+            return CONF.POLL_INTERVAL
+        next_poll_date = min(self.next_poll_dates.values())
+        return min(max(next_poll_date - time.monotonic(), 1), CONF.POLL_INTERVAL)
+
+    def schedule(self, stream):
+        """Schedule the next poll of a stream which has just been polled
+
+        :param stream: The polled stream
+        """
+        if stream.id in self.next_poll_dates:
+            self.next_poll_dates[stream.id] = time.monotonic() + self.get_interval(stream)
+
+    def poll_soon(self, stream_id):
+        """Poll a stream after POLL_MIN_INTERVAL seconds, whatever its interval"""
+        if stream_id in self.next_poll_dates:
+            next_poll_date = time.monotonic() + CONF.POLL_MIN_INTERVAL
+            self.next_poll_dates[stream_id] = min(self.next_poll_dates[stream_id], next_poll_date)
+
+    def record_online(self, stream, went_online=False):
+        """Update the activity of a stream seen online
+
+        :param stream: The online stream
+        :param went_online: True if the stream just went online
+        """
+        now = datetime.now()
+        stream.last_online_date = now
+        if went_online:
+            go_live_minutes = (stream.go_live_minutes or [])[-(GO_LIVE_HISTORY_SIZE - 1):]
+            stream.go_live_minutes = go_live_minutes + [now.hour * 60 + now.minute]
+
+    def get_interval(self, stream):
+        """Compute the poll interval of a stream
+
+        :param stream: The stream
+        :return: The number of seconds before the next poll
+        """
+        is_in_grace_window = stream.is_online and stream.last_offline_date
+        if stream.id in self.pushed_stream_ids and not is_in_grace_window:
+            return CONF.POLL_MAX_INTERVAL if stream.is_online else CONF.WEBHOOK_RECONCILIATION_INTERVAL
+
+        if stream.is_online or self._is_usual_go_live_time(stream):
+            return CONF.POLL_MIN_INTERVAL
+
+        last_online_date = stream.last_online_date
+        if last_online_date and (datetime.now() - last_online_date).total_seconds() > CONF.POLL_DORMANT_DURATION:
+            return CONF.POLL_MAX_INTERVAL
+
+        return CONF.POLL_INTERVAL
+
+    def _is_usual_go_live_time(self, stream):
+        now = datetime.now()
+        minute = now.hour * 60 + now.minute
+        window = CONF.POLL_GO_LIVE_WINDOW / 60
+        for go_live_minute in stream.go_live_minutes or []:
+            distance = abs(minute - go_live_minute)
+            if min(distance, MINUTES_PER_DAY - distance) <= window:
+                return True
+        return False
@@ -1,34 +1,90 @@
 import asyncio
 import collections
+from datetime import datetime
+import io
 import logging
+import time
 
+import discord
 from discord import errors
 from discord.ext import commands
 
 from discord_bot import cfg
+from discord_bot import client
 from discord_bot import log
+from discord_bot import metrics
 from discord_bot import utils
 
 from discord_bot.api import twitch
 
 from discord_bot.cogs.stream import db
+from discord_bot.cogs.stream import dispatcher
 from discord_bot.cogs.stream import embeds
+from discord_bot.cogs.stream import scheduler
+from discord_bot.cogs.stream import sharding
+from discord_bot.cogs.stream import webhook
 
 CONF = cfg.CONF
 LOG = logging.getLogger('debug')
 
+EXPORT_FILENAME = "streams.txt"
+
+TWITCH_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# Maximum number of stream names listed in a command answer
+MAX_REPORTED_NAMES = 20
+
+PREVIOUS_PAGE_EMOJI = "\N{BLACK LEFT-POINTING TRIANGLE}"
+NEXT_PAGE_EMOJI = "\N{BLACK RIGHT-POINTING TRIANGLE}"
+
+# Number of !stream list messages whose pages can be browsed
+MAX_STREAM_LIST_MESSAGES = 50
+
 
 class StreamManager:
 
     def __init__(self, bot):
         type(self).__name__ = "Stream commands"
         self.bot = bot
-        self.client = twitch.TwitchAPIClient()
+        self.client = twitch.TwitchAPIClient(self.bot.api_pool)
         self.db_driver = db.DBDriver()
         self.streams_by_id = {}
-
+        self.dispatcher = dispatcher.NotificationDispatcher(self.bot.loop, CONF.NOTIFICATION_MAX_CONCURRENT_JOBS)
+        self.scheduler = scheduler.PollScheduler(CONF.TWITCH_API_CHUNK_SIZE)
+        self.shards = sharding.ShardManager(self.bot.loop, self._on_shards_acquired, self._on_shards_released)
+        self.is_loaded = False
+        self.last_resync_date = time.monotonic()
+        self.poll_task = None
+        self.sync_task = None
+
+        # Push mode: the stream events are received by a webhook, the polling is only used to reconcile the status
+        self.webhook = None
+        if CONF.WEBHOOK_ENABLED:
+            self.eventsub_client = twitch.TwitchEventSubAPIClient(self.bot.api_pool)
+            self.webhook = webhook.WebhookReceiver(self.bot.loop, self._on_push_online, self._on_push_offline)
+
+        # Rendered pages of !stream list, and the messages displaying them {<message_id>: (<message>, <page index>)}
+        self.stream_list_pages = None
+        self.stream_list_pages_version = None
+        self.stream_names_version = 0
+        self.stream_list_messages = collections.OrderedDict()
+
+        metrics.NOTIFICATION_QUEUE_SIZE.set_function(self.dispatcher.get_size)
+        self.dispatcher.start()
         asyncio.ensure_future(self.load_database_data(), loop=self.bot.loop)
 
+    def __unload(self):
+        # The tasks of the unloaded cog must not keep polling and notifying along with the reloaded cog
+        for task in [self.poll_task, self.sync_task]:
+            if task:
+                task.cancel()
+        self.dispatcher.stop()
+        asyncio.ensure_future(self.shards.stop(), loop=self.bot.loop)
+        asyncio.ensure_future(self.client.close(), loop=self.bot.loop)
+        if self.webhook:
+            asyncio.ensure_future(self.webhook.stop(), loop=self.bot.loop)
+            asyncio.ensure_future(self.eventsub_client.close(), loop=self.bot.loop)
+
     async def load_database_data(self):
 
         await self.db_driver.setup()
@@ -39,110 +95,424 @@ class StreamManager:
         channels = await self.db_driver.get_channel()
         LOG.debug(f"Channels={channels}")
 
-        channel_streams = await self.db_driver.get_channel_stream()
-        LOG.debug(f"ChannelStreams={channel_streams}")
+        LOG.debug(f"Subscriptions={self.db_driver.subscriptions.channels_by_stream_id}")
 
         self.streams_by_id = {stream.id: stream for stream in streams}
+        self.client.cache_ids({stream.name: stream.id for stream in streams})
+        self.is_loaded = True
+
+    async def _resync(self):
+        """Reload the subscriptions and the streams, which may have been modified by the other instances
+
+        The streams already known keep their live state.
+        """
+        with metrics.DB_READ_DURATION.time():
+            streams = await self.db_driver.get_stream()
+            self.db_driver.subscriptions.load(await self.db_driver.get_channel_stream())
+        self.streams_by_id = {stream.id: self.streams_by_id.get(stream.id, stream) for stream in streams}
+        self.client.cache_ids({stream.name: stream.id for stream in streams})
+        self.stream_names_version += 1
+
+    async def _on_shards_acquired(self, shards):
+        """Reload the streams of the newly polled shards, which may have been modified by another instance
+
+        :param shards: The acquired shards
+        """
+        with metrics.DB_READ_DURATION.time():
+            streams_by_id = {stream.id: stream for stream in await self.db_driver.get_stream()}
+            self.db_driver.subscriptions.load(await self.db_driver.get_channel_stream())
+
+        # The streams of the shards which were already polled by this instance keep their live state
+        acquired_stream_ids = set()
+        for stream_id in streams_by_id:
+            if self.shards.ring.get_shard(stream_id) in shards:
+                acquired_stream_ids.add(stream_id)
+            elif stream_id in self.streams_by_id:
+                streams_by_id[stream_id] = self.streams_by_id[stream_id]
+        self.streams_by_id = streams_by_id
+        self.client.cache_ids({stream.name: stream.id for stream in streams_by_id.values()})
+
+        # Restore the live state of the streams: a stream having notifications was online before the restart (or
+        # before being polled by this instance), so it is not notified again and its notifications will be edited
+        # once it goes offline
+        with metrics.DB_READ_DURATION.time():
+            notifications = await self.db_driver.get_notification(stream_ids=acquired_stream_ids)
+        for notification in notifications:
+            stream = self.streams_by_id[notification.stream_id]
+            stream.notifications.append(notification)
+            stream.is_online = True
+        online_streams = [self.streams_by_id[stream_id].name for stream_id in acquired_stream_ids
+                          if self.streams_by_id[stream_id].is_online]
+        LOG.debug(f"Online streams of the shards {shards}: {online_streams}")
+
+    async def _on_shards_released(self, shards):
+        """Write the live state of the streams of the released shards for the instance which will poll them
+
+        :param shards: The released shards
+        """
+        await self.db_driver.flush_notifications()
+        await self.db_driver.flush_stream_activity()
 
     async def on_ready(self):
 
-        # Ensure that the database driver is ready before starting the polling
-        while not self.db_driver.ready:
+        # Ensure that the database data is loaded before starting the polling, the shard acquisition restoring the live
+        # state of the loaded streams
+        while not self.is_loaded:
             LOG.debug("Waiting for the database driver to be ready")
             await asyncio.sleep(1)
 
+        self.shards.start()
+
+        if self.webhook and not self.webhook.runner:
+            try:
+                await self.webhook.start()
+                self.sync_task = asyncio.ensure_future(self.sync_subscriptions(), loop=self.bot.loop)
+            except Exception as e:
+                message = "Cannot start the webhook receiver, the streams will only be polled"
+                LOG.exception(log.get_log_exception_message(message, e))
+
+        # on_ready is called again after a reconnection, the polling is already running
+        if self.poll_task:
+            return
         try:
-            asyncio.ensure_future(self.poll_streams(), loop=self.bot.loop)
+            self.poll_task = asyncio.ensure_future(self.poll_streams(), loop=self.bot.loop)
         except Exception as e:
             message = "The polling unexpectedly stopped"
             LOG.exception(log.get_log_exception_message(message, e))
 
     async def poll_streams(self):
-        """Poll twitch every X seconds."""
+        """Poll twitch, each stream being polled at its own interval (see scheduler.PollScheduler)."""
 
         LOG.debug("The polling has started")
 
-        async def on_stream_online(stream, notified_channels, status):
-            """ Method called if twitch stream goes online.
-
-            :param stream: The stream going online
-            :param notified_channels: The discord channels in which the stream is tracked
-            :param status: the API data for the stream going line
-            """
-            # Send the notifications in every discord channel the stream has been tracked
-            for channel, everyone in notified_channels:
-                message, embed = embeds.get_notification(status, everyone)
-                notification = await self.bot.send(channel, message, embed=embed, reaction=True)
-                stream.notifications.append(notification)
-
-        async def on_stream_offline(stream, notified_channels):
-            """Method called if the twitch stream is going offline.
-
-            :param stream: The stream going offline
-            :param notified_channels: The discord channels in which the stream is tracked
-            """
-            for notification in stream.notifications:
-                embed = notification.embeds[0]
-                offline_embed = embeds.get_offline_embed(embed)
-                try:
-                    await notification.edit(content="", embed=offline_embed)
-                    stream.notifications.remove(notification)
-                    LOG.debug(f"The notification for {stream.name} sent at {notification.created_at} has been edited at"
-                              f" {notification.edited_at}")
-                except errors.NotFound:
-                    LOG.warning(f"The notification for {stream.name} sent at {notification.created_at} does not exist "
-                                f"or has already been deleted")
-
         while True:
 
-            # Build a dictionary to easily iterate through the tracked streams
+            # The other instances modify the subscriptions of the streams polled by this instance
+            if CONF.POLL_SHARDS > 1 and time.monotonic() - self.last_resync_date > CONF.POLL_SHARD_RESYNC_INTERVAL:
+                self.last_resync_date = time.monotonic()
+                try:
+                    await self._resync()
+                except Exception as e:
+                    message = "Cannot reload the subscriptions"
+                    LOG.exception(log.get_log_exception_message(message, e))
+
+            # The subscriptions are read from the in-memory index, which is kept up to date by the commands and events.
             # {
-            #   "stream_id_1": [(<discord_channel_1>, everyone=True), (<discord_channel_2>, everyone=False|True), ...]
-            #   "stream_id_2": [(<discord_channel_2>, everyone=True), (<discord_channel_3>, everyone=False|True), ...]
-            #   "stream_id_3": [(<discord_channel_1>, everyone=True), (<discord_channel_3>, everyone=False|True), ...]
+            #   "stream_id_1": {<channel_id_1>: everyone=True, <channel_id_2>: everyone=False|True, ...}
+            #   "stream_id_2": {<channel_id_2>: everyone=True, <channel_id_3>: everyone=False|True, ...}
             # }
-            channels_by_stream_id = collections.defaultdict(list)
-            for cs in await self.db_driver.get_channel_stream():
-                channel = self.bot.get_channel(cs.channel_id)
-                channels_by_stream_id[cs.stream_id].append((channel, cs.everyone))
+            # Only the streams of the shards owned by this instance are polled
+            self.scheduler.sync([stream_id for stream_id in self.db_driver.subscriptions.channels_by_stream_id
+                                 if self.shards.owns(stream_id)])
+            polled_stream_ids = self.scheduler.get_due_streams()
+
+            metrics.TRACKED_STREAMS.set(len(self.db_driver.subscriptions.channels_by_stream_id))
+            metrics.TRACKED_CHANNELS.set(len(self.db_driver.subscriptions.streams_by_channel_id))
+
+            if polled_stream_ids:
+                await self._poll(polled_stream_ids)
+
+            with metrics.DB_WRITE_DURATION.time():
+                await self.db_driver.flush_notifications()
+                await self.db_driver.flush_stream_activity()
+            await asyncio.sleep(self.scheduler.get_sleep_duration())
+
+    async def _poll(self, polled_stream_ids):
+        """Poll the status of some streams
+
+        :param polled_stream_ids: The ids of the streams to poll
+        """
+        with metrics.POLL_DURATION.time():
 
-            # Get the status of all tracked streams
-            status = await self.client.get_status(*[stream_id for stream_id in self.streams_by_id])
+            # Get the status of the streams to poll
+            with metrics.STATUS_REQUEST_DURATION.time():
+                status = await self.client.get_status(*polled_stream_ids)
 
             # Check the response:
-            # - If a stream is online, status is a dictionary {"stream_id" : <stream data dict>, ...}
-            # - If all the streams are offline, status is an empty dict
-            # - If there is no answer from the API, status is None
+            # - status is a dictionary {"stream_id" : <stream data dict if online, None if offline>, ...}
+            # - If a chunk of streams couldn't be retrieved, its stream ids are missing from the dictionary and
+            #   they stay due for the next iteration
+            # - If there is no answer from the API at all, status is None
             if status is not None:
-                for stream_id, notified_channels in channels_by_stream_id.items():
-                    stream = self.streams_by_id[stream_id]
+                for stream_id in polled_stream_ids:
+
+                    # The status of this stream is unknown for this iteration
+                    if stream_id not in status or stream_id not in self.streams_by_id:
+                        continue
 
-                    # If the current stream id is in the API response, the stream is currently online
-                    if stream.id in status:
-                        stream.last_offline_date = None
-
-                        # Update streamer's name in the database if it has changed
-                        if not stream.name == status[stream.id]['channel']['name']:
-                            stream.update(name=status[stream.id]['channel']['name']).apply()
-
-                        # If the stream was not online during the previous iteration, the stream just went online
-                        if not stream.is_online:
-                            await on_stream_online(stream, notified_channels, status[stream.id])
-                            channels_str = [f"{nc[0].name}#{nc[0].id}" for nc in notified_channels]
-                            LOG.debug(f"{stream.name} is live and notified in the channels: {', '.join(channels_str)}")
-                            stream.is_online = True
-
-                    # If the stream is offline, but was online during the previous iteration, the stream just went
-                    # offline.
-                    # To avoid spam if a stream keeps going online/offline because of Twitch or bad connections,
-                    # we consider a stream as offline if it was offline for at least MIN_OFFLINE_DURATION
-                    elif stream.is_online and stream.offline_duration > CONF.MIN_OFFLINE_DURATION:
-                            await on_stream_offline(stream, notified_channels)
-                            stream.is_online = False
-                            LOG.debug(f"{stream.name} just went offline")
+                    # A failure (e.g. while renaming the stream in the database) only skips this stream
+                    stream = self.streams_by_id[stream_id]
+                    try:
+                        await self._update_stream(stream, status[stream_id])
+                    except Exception as e:
+                        message = f"Cannot update the status of the stream {stream.name}#{stream.id}"
+                        LOG.exception(log.get_log_exception_message(message, e))
+                    self.scheduler.schedule(stream)
             else:
                 LOG.warning("Cannot retrieve status, the polling iteration has been skipped.")
-            await asyncio.sleep(10)
+
+    async def sync_subscriptions(self):
+        """Subscribe to the events of the polled streams every WEBHOOK_SUBSCRIPTION_SYNC_INTERVAL seconds."""
+
+        while True:
+            try:
+                await self._sync_subscriptions()
+            except Exception as e:
+                message = "Cannot synchronize the webhook subscriptions"
+                LOG.exception(log.get_log_exception_message(message, e))
+            await asyncio.sleep(CONF.WEBHOOK_SUBSCRIPTION_SYNC_INTERVAL)
+
+    async def _sync_subscriptions(self):
+        """Create the missing subscriptions of the streams polled by this instance, and delete the others"""
+
+        subscriptions = await self.eventsub_client.get_subscriptions()
+        if subscriptions is None:
+            return
+
+        # {(<event type>, <stream_id>): <subscription>} for the subscriptions sent to this instance
+        subscriptions = {(s['type'], int(s['condition']['broadcaster_user_id'])): s for s in subscriptions
+                         if s['transport'].get('callback') == CONF.WEBHOOK_CALLBACK_URL}
+        expected_keys = {(event_type, stream_id) for stream_id in self.db_driver.subscriptions.channels_by_stream_id
+                         if self.shards.owns(stream_id) for event_type in [webhook.ONLINE_EVENT, webhook.OFFLINE_EVENT]}
+
+        semaphore = asyncio.Semaphore(CONF.TWITCH_API_MAX_CONCURRENT_REQUESTS)
+
+        async def create(event_type, stream_id):
+            async with semaphore:
+                await self.eventsub_client.create_subscription(event_type, stream_id, CONF.WEBHOOK_CALLBACK_URL,
+                                                               CONF.WEBHOOK_SECRET)
+
+        async def delete(subscription_id):
+            async with semaphore:
+                await self.eventsub_client.delete_subscription(subscription_id)
+
+        jobs = [create(*key) for key in expected_keys - set(subscriptions)]
+        jobs += [delete(subscriptions[key]['id']) for key in set(subscriptions) - expected_keys]
+        await asyncio.gather(*jobs)
+
+        # The streams whose events are both received are only polled to reconcile their status
+        enabled_keys = {key for key, subscription in subscriptions.items()
+                        if key in expected_keys and subscription['status'] == "enabled"}
+        self.scheduler.pushed_stream_ids = {stream_id for event_type, stream_id in enabled_keys
+                                            if (webhook.OFFLINE_EVENT, stream_id) in enabled_keys}
+        LOG.debug(f"Webhook subscriptions: {len(jobs)} changes, {len(self.scheduler.pushed_stream_ids)} streams "
+                  f"pushed")
+
+    async def _on_push_online(self, stream_id):
+        """Method called when the webhook receives a stream.online event
+
+        :param stream_id: The stream going online
+        """
+        stream = self.streams_by_id.get(stream_id)
+        if not stream or not self.shards.owns(stream_id):
+            return
+
+        # The notification needs the stream data which are not sent with the event
+        status = await self.client.get_status(stream_id)
+        if status and status.get(stream_id):
+            await self._update_stream(stream, status[stream_id])
+            self.scheduler.schedule(stream)
+        else:
+            # The API doesn't see the stream online yet
+            self.scheduler.poll_soon(stream_id)
+
+    async def _on_push_offline(self, stream_id):
+        """Method called when the webhook receives a stream.offline event
+
+        :param stream_id: The stream going offline
+        """
+        stream = self.streams_by_id.get(stream_id)
+        if stream and self.shards.owns(stream_id):
+            await self._update_stream(stream, None)
+            self.scheduler.schedule(stream)
+
+    async def _update_stream(self, stream, status):
+        """Compare the polled status of a stream with its previous status
+
+        :param stream: The polled stream
+        :param status: The API data of the stream if it's online, None otherwise
+        """
+        # A stream never seen online counts from the date it is first polled, and becomes dormant after
+        # POLL_DORMANT_DURATION. The date is stored, so that the restarts don't make the streams active again.
+        if stream.last_online_date is None:
+            stream.last_online_date = datetime.now()
+            self.db_driver.update_stream_activity(stream)
+
+        # If the current stream has data in the API response, the stream is currently online
+        if status:
+            stream.last_offline_date = None
+
+            # If the stream was not online during the previous iteration, the stream just went online
+            went_online = not stream.is_online
+            if went_online:
+                notified_channels = self._get_notified_channels(stream.id)
+                with metrics.ONLINE_HANDLER_DURATION.time():
+                    await self._on_stream_online(stream, notified_channels, status)
+                channels_str = [f"{nc[0].name}#{nc[0].id}" for nc in notified_channels]
+                LOG.debug(f"{stream.name} is live and will be notified in the channels: {', '.join(channels_str)}")
+                stream.is_online = True
+                stream.fingerprint = embeds.get_fingerprint(status)
+            else:
+                await self._check_stream_changes(stream, status)
+            self.scheduler.record_online(stream, went_online)
+            if went_online:
+                self.db_driver.update_stream_activity(stream)
+
+            # Update streamer's name in the database if it has changed
+            if not stream.name == status['channel']['name']:
+                await stream.update(name=status['channel']['name']).apply()
+                self.client.cache_ids({stream.name: stream.id})
+                self.stream_names_version += 1
+
+        # If the stream is offline, but was online during the previous iteration, the stream just went
+        # offline.
+        # To avoid spam if a stream keeps going online/offline because of Twitch or bad connections,
+        # we consider a stream as offline if it was offline for at least MIN_OFFLINE_DURATION
+        elif stream.is_online and stream.offline_duration > CONF.MIN_OFFLINE_DURATION:
+            with metrics.OFFLINE_HANDLER_DURATION.time():
+                await self._on_stream_offline(stream, self._get_notified_channels(stream.id))
+            stream.is_online = False
+            self.db_driver.update_stream_activity(stream)
+            LOG.debug(f"{stream.name} just went offline")
+
+    async def _check_stream_changes(self, stream, status):
+        """Update the notifications of a live stream if its title or its game has changed
+
+        A change is only applied once it has been stable for NOTIFICATION_EDIT_DEBOUNCE seconds, to not edit every
+        notification on each change.
+
+        :param stream: The live stream
+        :param status: The API data of the stream
+        """
+        fingerprint = embeds.get_fingerprint(status)
+        now = datetime.now()
+
+        # The notifications have been sent before the last restart, their content is unknown
+        if stream.fingerprint is None:
+            stream.fingerprint = fingerprint
+
+        if fingerprint == stream.fingerprint:
+            stream.pending_fingerprint = None
+        elif fingerprint != stream.pending_fingerprint:
+            stream.pending_fingerprint = fingerprint
+            stream.pending_fingerprint_date = now
+        elif (now - stream.pending_fingerprint_date).total_seconds() >= CONF.NOTIFICATION_EDIT_DEBOUNCE:
+            stream.fingerprint = fingerprint
+            stream.pending_fingerprint = None
+            LOG.debug(f"The title or the game of {stream.name} has changed, {len(stream.notifications)} notifications "
+                      f"will be edited")
+            for notification in stream.notifications:
+                self.dispatcher.submit(dispatcher.EDITION, ("messages", notification.channel_id),
+                                       self._edit_live_notification, stream, notification, status)
+
+    async def _on_stream_online(self, stream, notified_channels, status):
+        """ Method called if twitch stream goes online.
+
+        The notifications are handed to the dispatcher, they are not sent yet when this method returns.
+
+        :param stream: The stream going online
+        :param notified_channels: The discord channels in which the stream is tracked
+        :param status: the API data for the stream going line
+        """
+        # Send the notifications in every discord channel the stream has been tracked
+        for channel, everyone in notified_channels:
+            message, embed = embeds.get_notification(status, everyone)
+            self.dispatcher.submit(dispatcher.NOTIFICATION, ("messages", channel.id), self._send_notification, stream,
+                                   channel, message, embed, status.get('created_at'))
+
+    async def _on_stream_offline(self, stream, notified_channels):
+        """Method called if the twitch stream is going offline.
+
+        :param stream: The stream going offline
+        :param notified_channels: The discord channels in which the stream is tracked
+        """
+        notifications, stream.notifications = stream.notifications, []
+        for notification in notifications:
+            self.db_driver.remove_notification(notification)
+            self.dispatcher.submit(dispatcher.EDITION, ("messages", notification.channel_id),
+                                   self._edit_offline_notification, stream, notification)
+
+    async def _send_notification(self, stream, channel, content, embed, created_at=None):
+        # The stream went offline since the notification has been queued
+        if not stream.is_online:
+            return
+
+        message = await self.bot.send(channel, content, embed=embed)
+        if created_at:
+            lag = datetime.utcnow() - datetime.strptime(created_at, TWITCH_DATE_FORMAT)
+            metrics.NOTIFICATION_LAG.observe(lag.total_seconds())
+        notification = db.Notification(message_id=message.id, channel_id=channel.id, stream_id=stream.id)
+        notification.message = message
+        if stream.is_online:
+            stream.notifications.append(notification)
+            self.db_driver.add_notification(notification)
+        else:
+            # The stream went offline while the notification was sent, its notifications have already been edited
+            self.dispatcher.submit(dispatcher.EDITION, ("messages", channel.id), self._edit_offline_notification,
+                                   stream, notification)
+        self.dispatcher.submit(dispatcher.REACTION, ("reactions", channel.id), message.add_reaction,
+                               client.WASTEBASKET_EMOJI)
+
+    async def _get_notification_message(self, notification):
+        """Return the discord message of a notification
+
+        The message is only fetched from discord if the notification has been sent before the last restart.
+
+        :param notification: The notification
+        :return: The discord message, None if it does not exist anymore
+        """
+        if not notification.message:
+            channel = self.bot.get_channel(notification.channel_id)
+            if channel:
+                try:
+                    notification.message = await channel.get_message(notification.message_id)
+                except errors.NotFound:
+                    pass
+        return notification.message
+
+    async def _edit_live_notification(self, stream, notification, status):
+        # The stream went offline since the edition has been queued
+        if notification not in stream.notifications:
+            return
+
+        everyone = self.db_driver.subscriptions.get_channels(stream.id).get(notification.channel_id, False)
+        _, embed = embeds.get_notification(status, everyone)
+        message = await self._get_notification_message(notification)
+        try:
+            if message:
+                await message.edit(embed=embed)
+                return
+        except errors.NotFound:
+            pass
+        LOG.warning(f"The notification {notification.message_id} for {stream.name} does not exist or has already "
+                    f"been deleted")
+
+    async def _edit_offline_notification(self, stream, notification):
+        message = await self._get_notification_message(notification)
+        try:
+            if message:
+                offline_embed = embeds.get_offline_embed(message.embeds[0])
+                await message.edit(content="", embed=offline_embed)
+                LOG.debug(f"The notification for {stream.name} sent at {message.created_at} has been edited at"
+                          f" {message.edited_at}")
+                return
+        except errors.NotFound:
+            pass
+        LOG.warning(f"The notification {notification.message_id} for {stream.name} does not exist or has already "
+                    f"been deleted")
+
+    def _get_notified_channels(self, stream_id):
+        """Return the discord channels in which a stream is tracked
+
+        :param stream_id: The twitch stream id
+        :return: [(<discord_channel_1>, everyone=True), (<discord_channel_2>, everyone=False|True), ...]
+        """
+        notified_channels = []
+        for channel_id, everyone in list(self.db_driver.subscriptions.get_channels(stream_id).items()):
+            channel = self.bot.get_channel(channel_id)
+            if channel:
+                notified_channels.append((channel, everyone))
+        return notified_channels
 
     # COMMANDS
 
@@ -152,15 +522,10 @@ class StreamManager:
         if ctx.invoked_subcommand is None:
             await ctx.invoke(self.bot.get_command('help'), "stream")
 
-    @stream.command()
-    async def list(self, ctx):
-        """List current tracked streams."""
-
-        channel_streams = await self.db_driver.get_channel_stream()
-
-        if channel_streams:
-
-            streams = {stream.id: stream for stream in await self.db_driver.get_stream()}
+    def _get_stream_list_pages(self):
+        """Return the pages of the stream list, which are rendered again only if the subscriptions have changed"""
+        version = (self.db_driver.subscriptions.version, self.stream_names_version)
+        if self.stream_list_pages_version != version:
 
             # Build the output data by storing every stream names notified for each discord channel
             # {
@@ -169,102 +534,192 @@ class StreamManager:
             #   <discord_channel_3>: ["stream_name_1", "stream_name_3", ...]
             # }
             streams_by_channel = collections.defaultdict(list)
-            for cs in await self.db_driver.get_channel_stream():
-                channel = self.bot.get_channel(cs.channel_id)
-                stream = streams[cs.stream_id]
-                streams_by_channel[channel].append(stream.name)
+            for channel_id, stream_ids in self.db_driver.subscriptions.streams_by_channel_id.items():
+                channel = self.bot.get_channel(channel_id)
+                if channel:
+                    streams_by_channel[channel] = [self.streams_by_id[stream_id].name for stream_id in stream_ids]
 
-            # Build an embed displaying the output data.
+            # Build the embeds displaying the output data.
             # - The discord channels are sorted in the same order as on the server
             # - The stream names are sorted in alphabetical order
+            self.stream_list_pages = embeds.get_stream_list_embeds(streams_by_channel)
+            self.stream_list_pages_version = version
+        return self.stream_list_pages
+
+    @stream.command()
+    async def list(self, ctx):
+        """List current tracked streams."""
+
+        if self.db_driver.subscriptions.channels_by_stream_id:
+            pages = self._get_stream_list_pages()
             message = "Tracked channels"
-            embed = embeds.get_stream_list_embed(streams_by_channel)
+            list_message = await self.bot.send(ctx.channel, message, embed=pages[0], reaction=True)
+
+            # Allow to navigate between the pages using the reactions
+            if len(pages) > 1:
+                self.stream_list_messages[list_message.id] = (list_message, 0)
+                while len(self.stream_list_messages) > MAX_STREAM_LIST_MESSAGES:
+                    self.stream_list_messages.popitem(last=False)
+                await list_message.add_reaction(PREVIOUS_PAGE_EMOJI)
+                await list_message.add_reaction(NEXT_PAGE_EMOJI)
 
-            await self.bot.send(ctx.channel, message, embed=embed, reaction=True)
+    async def _add_streams(self, channel, stream_names, everyone=False):
+        """ Add streams in a discord channel tracklist
 
-    async def _add_stream(self, channel, stream_name, everyone=False):
-        """ Add a stream in a discord channel tracklist
+        The ids are resolved in a single API call and the streams are stored in a single transaction.
 
         :param channel: The discord channel in which the stream notifications are enabled
-        :param stream_name: The stream to notify
+        :param stream_names: The streams to notify, or {<stream_name>: <everyone>}
         :param everyone: If True, add the tag @everyone to the bot notification
+        :return: The lists of the added streams, the already tracked streams and the unknown streams, None if the ids
+        couldn't be retrieved
         """
-        stream_name = stream_name.lower()
-        stream_id = int((await self.client.get_ids(stream_name))[stream_name])
-        if not await self.db_driver.get_channel_stream(channel_id=channel.id, stream_id=stream_id):
+        if not isinstance(stream_names, dict):
+            stream_names = {stream_name: everyone for stream_name in stream_names}
+        everyone_by_name = {stream_name.lower(): everyone for stream_name, everyone in stream_names.items()}
+
+        ids_by_name = await self.client.get_ids(*everyone_by_name)
+        if ids_by_name is None:
+            LOG.warning(f"Cannot retrieve the ids of the streams to add in the channel {channel.name}#{channel.id}")
+            return None
+        unknown_names = [name for name in everyone_by_name if name not in ids_by_name]
+        subscriptions = [(int(ids_by_name[name]), name, everyone) for name, everyone in everyone_by_name.items()
+                         if name in ids_by_name]
+
+        added_names = []
+        already_tracked_names = [name for stream_id, name, _ in subscriptions
+                                 if (channel.id, stream_id) in self.db_driver.subscriptions]
+        subscriptions = [subscription for subscription in subscriptions if subscription[1] not in already_tracked_names]
+
+        if subscriptions:
+            added_stream_ids = await self.db_driver.create_channel_streams(channel, subscriptions)
+            for stream_id, name, _ in subscriptions:
+                if stream_id in added_stream_ids:
+                    added_names.append(name)
+                    if stream_id not in self.streams_by_id:
+                        self.streams_by_id[stream_id] = db.Stream(id=stream_id, name=name)
+                else:
+                    already_tracked_names.append(name)
+
+        LOG.debug(f"Streams added in the channel {channel.name}#{channel.id}: {added_names} (already tracked: "
+                  f"{already_tracked_names}, unknown: {unknown_names})")
+        return added_names, already_tracked_names, unknown_names
+
+    async def _send_add_report(self, channel, report):
+        if report is None:
+            await self.bot.send(channel, "The Twitch API is unavailable, the streams couldn't be added",
+                                code_block=True)
+            return
+
+        def get_names(names):
+            shown_names = ", ".join(names[:MAX_REPORTED_NAMES])
+            if len(names) > MAX_REPORTED_NAMES:
+                shown_names += f" and {len(names) - MAX_REPORTED_NAMES} more"
+            return shown_names
+
+        added_names, already_tracked_names, unknown_names = report
+        lines = []
+        if added_names:
+            lines.append(f"{get_names(added_names)} now tracked in '{channel.guild.name}:{channel.name}'")
+        if already_tracked_names:
+            lines.append(f"{get_names(already_tracked_names)} already tracked in this channel")
+        if unknown_names:
+            lines.append(f"Unknown streams: {get_names(unknown_names)}")
+        await self.bot.send(channel, "\n".join(lines), code_block=True)
 
-            # Store the twitch stream in the database if it wasn't tracked anywhere before
-            if not await self.db_driver.get_stream(name=stream_name):
-                stream = await self.db_driver.create_stream(id=stream_id, name=stream_name)
-                self.streams_by_id[stream_id] = stream
-            else:
-                LOG.debug(f"The stream {stream_name}#{stream_id} has already been stored in the database")
+    @stream.command()
+    @commands.check(utils.check_is_admin)
+    async def add(self, ctx, *stream_names):
+        """ Add streams to the tracked list
 
-            # Store the discord channel in the database if it wasn't tracked anywhere before
-            if not await self.db_driver.get_channel(id=channel.id):
-                await self.db_driver.create_channel(id=channel.id, name=channel.name, guild_id=channel.guild.id,
-                                                    guild_name=channel.guild.name)
-            else:
-                LOG.debug(f"The channel {channel.name}#{channel.id} has already been stored in the database")
+        :param ctx: command context
+        :param stream_names: The streams to notify
+        """
+        if not stream_names:
+            await ctx.invoke(self.bot.get_command('help'), "stream", "add")
+            return
+        await self._send_add_report(ctx.channel, await self._add_streams(ctx.channel, stream_names))
 
-            # Create a new relation between the twitch stream and the discord channel
-            await self.db_driver.create_channel_stream(channel_id=channel.id, stream_id=stream_id, everyone=everyone)
-            return True
+    @stream.command()
+    @commands.check(utils.check_is_admin)
+    async def everyone(self, ctx, *stream_names):
+        """ Add streams to the tracked list (with @everyone)
 
-        else:
-            LOG.warning(f"{stream_name}#{stream_id} is already track in the channel {channel.name}#{channel.id}")
-        return False
+        :param ctx: command context
+        :param stream_names: The streams to notify
+        """
+        if not stream_names:
+            await ctx.invoke(self.bot.get_command('help'), "stream", "everyone")
+            return
+        await self._send_add_report(ctx.channel, await self._add_streams(ctx.channel, stream_names, everyone=True))
 
-    @stream.command()
+    @stream.command(name="import")
     @commands.check(utils.check_is_admin)
-    async def add(self, ctx, stream_name):
-        """ Add a stream to the tracked list
+    async def import_(self, ctx):
+        """ Add the streams of the attached file to the tracked list
+
+        The file contains one stream per line. Add 'everyone' after the stream name to tag @everyone, e.g:
+        stream_name_1
+        stream_name_2 everyone
 
         :param ctx: command context
-        :param stream_name: The stream to notify
         """
-        channel = ctx.channel
-        if await self._add_stream(channel, stream_name.lower()):
-            await self.bot.send(channel, f"{stream_name} is now tracked in '{channel.guild.name}:{channel.name}'",
-                                code_block=True)
+        if not ctx.message.attachments:
+            await self.bot.send(ctx.channel, "A file containing the streams to add must be attached", code_block=True)
+            return
+
+        content = io.BytesIO()
+        await ctx.message.attachments[0].save(content)
+
+        stream_names = {}
+        for line in content.getvalue().decode(errors="ignore").splitlines():
+            words = line.split()
+            if words:
+                stream_names[words[0]] = len(words) > 1 and words[1].lower() == "everyone"
+
+        if not stream_names:
+            await self.bot.send(ctx.channel, "The attached file doesn't contain any stream", code_block=True)
+            return
+        await self._send_add_report(ctx.channel, await self._add_streams(ctx.channel, stream_names))
 
     @stream.command()
     @commands.check(utils.check_is_admin)
-    async def everyone(self, ctx, stream_name):
-        """ Add a stream to the tracked list (with @everyone)
+    async def export(self, ctx):
+        """ Export the streams tracked in this channel (see !stream import)
 
         :param ctx: command context
-        :param stream_name: The stream to notify
         """
         channel = ctx.channel
-        if await self._add_stream(ctx.channel, stream_name.lower(), everyone=True):
-            await self.bot.send(ctx.channel, f"{stream_name} is now tracked in '{channel.guild.name}:{channel.name}'",
-                                code_block=True)
+        lines = []
+        for stream_id in self.db_driver.subscriptions.get_streams(channel.id):
+            everyone = self.db_driver.subscriptions.get_channels(stream_id).get(channel.id)
+            lines.append(self.streams_by_id[stream_id].name + (" everyone" if everyone else ""))
+
+        content = io.BytesIO("\n".join(sorted(lines)).encode())
+        await self.bot.send(channel, f"{len(lines)} streams tracked in '{channel.guild.name}:{channel.name}'",
+                            file=discord.File(content, filename=EXPORT_FILENAME))
 
     async def _remove_stream(self, channel, stream_name):
         stream_id = int((await self.client.get_ids(stream_name))[stream_name])
-        channel_streams = await self.db_driver.get_channel_stream(channel_id=channel.id, stream_id=stream_id)
-        if channel_streams:
-            channel_stream = channel_streams[0]
-            channel_db = (await self.db_driver.get_channel(id=channel_stream.channel_id))[0]
-            stream_db = (await self.db_driver.get_stream(id=channel_stream.stream_id))[0]
+        if (channel.id, stream_id) in self.db_driver.subscriptions:
+            stream = self.streams_by_id[stream_id]
 
             # Remove the relation between the twitch stream and the discord channel
-            await channel_stream.delete()
-            LOG.debug(f"{stream_db.name} is no longer tracked in '{channel.guild.name}:{channel.name}'")
+            await self.db_driver.delete_channel_stream(channel.id, stream_id)
+            LOG.debug(f"{stream.name} is no longer tracked in '{channel.guild.name}:{channel.name}'")
 
             # Remove the discord channel from the database if there no streams notified in it
-            if not await self.db_driver.get_channel_stream(channel_id=channel.id):
+            if not self.db_driver.subscriptions.get_streams(channel.id):
                 LOG.debug(f"There is no stream tracked in the channel {channel.name}#{channel.id}, the channel is "
                           "deleted from the database")
-                await channel_db.delete()
+                await self.db_driver.delete_channel(channel.id)
 
             # Remove the twitch stream from the database of it's not notified anymore
-            if not await self.db_driver.get_channel_stream(stream_id=stream_id):
-                LOG.debug(f"The stream {stream_db.name}#{stream_db.id} is no longer tracked in any channel, the stream "
+            if not self.db_driver.subscriptions.get_channels(stream_id):
+                LOG.debug(f"The stream {stream.name}#{stream.id} is no longer tracked in any channel, the stream "
                           "is deleted from the database")
-                del self.streams_by_id[stream_db.id]
-                await stream_db.delete()
+                del self.streams_by_id[stream.id]
+                await self.db_driver.delete_stream(stream.id)
             return True
 
     @stream.command()
@@ -281,6 +736,32 @@ class StreamManager:
                                 code_block=True)
 
     # EVENTS
+    async def on_raw_reaction_add(self, payload):
+        """Event called when a reaction is added, used to browse the pages of !stream list
+
+        :param payload: the reaction data
+        """
+        if payload.message_id not in self.stream_list_messages or payload.user_id == self.bot.user.id:
+            return
+
+        emoji = payload.emoji.name
+        if emoji not in [PREVIOUS_PAGE_EMOJI, NEXT_PAGE_EMOJI]:
+            return
+
+        message, index = self.stream_list_messages[payload.message_id]
+        pages = self._get_stream_list_pages()
+        index = index - 1 if emoji == PREVIOUS_PAGE_EMOJI else index + 1
+        index = index % len(pages)
+        self.stream_list_messages[payload.message_id] = (message, index)
+        await message.edit(embed=pages[index])
+
+        # Remove the reaction so that the user can click on it again
+        user = message.guild.get_member(payload.user_id)
+        try:
+            await message.remove_reaction(emoji, user)
+        except errors.Forbidden:
+            pass
+
     async def on_guild_channel_delete(self, channel):
         """Event called when a discord channel is deleted.
 
@@ -288,17 +769,22 @@ class StreamManager:
         """
         LOG.debug(f"The channel '{channel.guild.name}:{channel.name}' has been deleted")
 
-        for channel_stream in await self.db_driver.get_channel_stream(channel_id=channel.id):
+        stream_ids, deleted_stream_ids = await self.db_driver.purge_channel(channel.id)
 
-            stream = (await self.db_driver.get_stream(id=channel_stream.stream_id))[0]
-            await channel_stream.delete()
-            LOG.debug(f"{stream.name} is no longer tracked in '{channel.guild.name}:{channel.name}'")
+        stream_names = [self.streams_by_id[stream_id].name for stream_id in stream_ids]
+        LOG.debug(f"{stream_names} are no longer tracked in '{channel.guild.name}:{channel.name}'")
 
-            # Remove the twitch stream from the database of it's not notified anymore
-            if not await self.db_driver.get_channel_stream(stream_id=stream.id):
-                LOG.debug(f"The stream {stream.name}#{stream.id} is no longer tracked in any channel, the stream is "
-                          "deleted from the database")
-                await stream.delete()
+        # The notifications sent in the deleted channel don't exist anymore
+        for stream_id in stream_ids:
+            stream = self.streams_by_id[stream_id]
+            stream.notifications = [notification for notification in stream.notifications
+                                    if notification.channel_id != channel.id]
+
+        # Remove the twitch streams which are not notified anymore
+        for stream_id in deleted_stream_ids:
+            stream = self.streams_by_id.pop(stream_id)
+            LOG.debug(f"The stream {stream.name}#{stream.id} is no longer tracked in any channel, the stream has been "
+                      "deleted from the database")
 
 
 def setup(bot):
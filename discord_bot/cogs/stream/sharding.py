@@ -0,0 +1,152 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import time
+
+from discord_bot import cfg
+from discord_bot import log
+
+from discord_bot.cogs.stream.db import db
+
+CONF = cfg.CONF
+LOG = logging.getLogger('debug')
+
+# First key of the advisory locks, the second key being the shard index
+LOCK_NAMESPACE = 0x5354
+
+# Number of points of each shard on the hash ring
+RING_REPLICAS = 100
+
+
+def _hash(value):
+    return int(hashlib.md5(str(value).encode()).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Consistent hashing of the stream ids over the shards
+
+    Changing the number of shards only moves the streams of the added or removed shards.
+    """
+
+    def __init__(self, shard_count):
+        points = sorted((_hash(f"{shard}:{replica}"), shard)
+                        for shard in range(shard_count) for replica in range(RING_REPLICAS))
+        self.hashes = [point[0] for point in points]
+        self.shards = [point[1] for point in points]
+
+    def get_shard(self, stream_id):
+        index = bisect.bisect(self.hashes, _hash(stream_id)) % len(self.hashes)
+        return self.shards[index]
+
+
+class ShardManager:
+    """Share the polling of the streams between several bot instances
+
+    The streams are split in POLL_SHARDS shards. An instance polls the streams of a shard while it holds the Postgres
+    advisory lock of the shard, on a dedicated connection (the lock is released if the instance dies).
+
+    Each instance has a home shard (POLL_SHARD_ID) that it always tries to lock. It also locks the shards that no
+    other instance holds, to take over the shards of a stopped instance, but it releases them every POLL_SHARD_LEASE
+    seconds so that their home instance can take them back.
+
+    :param on_acquire: coroutine function called with the set of the newly owned shards
+    :param before_release: coroutine function called with the set of the shards about to be released
+    """
+
+    def __init__(self, loop, on_acquire, before_release):
+        self.loop = loop
+        self.on_acquire = on_acquire
+        self.before_release = before_release
+        self.ring = HashRing(CONF.POLL_SHARDS)
+        self.owned_shards = set()
+        self.acquisition_dates = {}
+        self.release_dates = {}
+        self.connection = None
+        self.task = None
+
+    def owns(self, stream_id):
+        return self.ring.get_shard(stream_id) in self.owned_shards
+
+    def start(self):
+        if not self.task:
+            self.task = asyncio.ensure_future(self._run(), loop=self.loop)
+
+    async def stop(self):
+        """Stop checking the shards and release their locks, e.g. when the cog is unloaded"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+        try:
+            if self.owned_shards:
+                await self.before_release(set(self.owned_shards))
+            # The connection goes back to the pool, its session-level locks would outlive the cog
+            if self.connection:
+                await self.connection.scalar(db.select([db.func.pg_advisory_unlock_all()]))
+        except Exception as e:
+            message = "Cannot release the poll shards"
+            LOG.exception(log.get_log_exception_message(message, e))
+        self.owned_shards.clear()
+        await self._close_connection()
+
+    async def _run(self):
+        while True:
+            try:
+                if not self.connection:
+                    self.connection = await db.acquire()
+                await self._check_shards()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The locks are lost with the connection
+                message = "Cannot check the poll shards"
+                LOG.exception(log.get_log_exception_message(message, e))
+                if self.owned_shards:
+                    await self.before_release(set(self.owned_shards))
+                self.owned_shards.clear()
+                await self._close_connection()
+            await asyncio.sleep(CONF.POLL_SHARD_CHECK_INTERVAL)
+
+    async def _check_shards(self):
+        now = time.monotonic()
+
+        # Release the foreign shards whose lease has expired
+        expired_shards = {shard for shard in self.owned_shards if shard != CONF.POLL_SHARD_ID and
+                          now - self.acquisition_dates[shard] > CONF.POLL_SHARD_LEASE}
+        if expired_shards:
+            await self.before_release(expired_shards)
+            for shard in expired_shards:
+                await self.connection.scalar(db.select([db.func.pg_advisory_unlock(LOCK_NAMESPACE, shard)]))
+                self.owned_shards.discard(shard)
+                self.release_dates[shard] = now
+            LOG.debug(f"The poll shards {expired_shards} have been released")
+
+        # Lock the free shards. A released shard is not locked again before its home instance had the time to lock it
+        acquired_shards = set()
+        for shard in range(CONF.POLL_SHARDS):
+            if shard in self.owned_shards:
+                continue
+            if shard != CONF.POLL_SHARD_ID and \
+                    now - self.release_dates.get(shard, -float("inf")) < 2 * CONF.POLL_SHARD_CHECK_INTERVAL:
+                continue
+            if await self.connection.scalar(db.select([db.func.pg_try_advisory_lock(LOCK_NAMESPACE, shard)])):
+                acquired_shards.add(shard)
+                self.acquisition_dates[shard] = now
+
+        if acquired_shards:
+            LOG.debug(f"The poll shards {acquired_shards} have been acquired")
+            await self.on_acquire(acquired_shards)
+            self.owned_shards |= acquired_shards
+
+    async def _close_connection(self):
+        if self.connection:
+            try:
+                await self.connection.release()
+            except Exception:
+                pass
+        self.connection = None
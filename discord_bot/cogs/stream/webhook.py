@@ -0,0 +1,138 @@
+import asyncio
+from datetime import datetime, timezone
+import hashlib
+import hmac
+import json
+import logging
+
+from aiohttp import web
+
+from discord_bot import cfg
+from discord_bot import log
+
+from discord_bot.api import cache
+
+CONF = cfg.CONF
+LOG = logging.getLogger('debug')
+
+ONLINE_EVENT = "stream.online"
+OFFLINE_EVENT = "stream.offline"
+
+MESSAGE_ID_HEADER = "Twitch-Eventsub-Message-Id"
+MESSAGE_TIMESTAMP_HEADER = "Twitch-Eventsub-Message-Timestamp"
+MESSAGE_SIGNATURE_HEADER = "Twitch-Eventsub-Message-Signature"
+MESSAGE_TYPE_HEADER = "Twitch-Eventsub-Message-Type"
+
+# The messages older than this number of seconds are rejected, to prevent replay attacks
+MAX_MESSAGE_AGE = 600
+
+
+def sign(secret, message_id, timestamp, body):
+    """Compute the signature of a callback
+
+    :param secret: The secret shared with Twitch when creating the subscriptions
+    :param message_id: The value of the Twitch-Eventsub-Message-Id header
+    :param timestamp: The value of the Twitch-Eventsub-Message-Timestamp header
+    :param body: The raw body of the request
+    :return: The expected value of the Twitch-Eventsub-Message-Signature header
+    """
+    message = message_id.encode() + timestamp.encode() + body
+    return "sha256=" + hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def _parse_timestamp(timestamp):
+    # RFC3339 timestamp with nanoseconds, e.g. 2019-11-16T10:11:12.123456789Z
+    date, _, fraction = timestamp.rstrip("Z").partition(".")
+    date = datetime.strptime(date, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
+    return date.timestamp() + float("0." + (fraction or "0"))
+
+
+class WebhookReceiver:
+    """HTTP server receiving the signed stream.online and stream.offline callbacks (Twitch EventSub)
+
+    :param on_online: coroutine function called with the id of a stream going online
+    :param on_offline: coroutine function called with the id of a stream going offline
+    """
+
+    def __init__(self, loop, on_online, on_offline):
+        self.loop = loop
+        self.on_online = on_online
+        self.on_offline = on_offline
+        self.runner = None
+
+        # Twitch can send a message several times
+        self.message_ids = cache.TTLCache(10000, MAX_MESSAGE_AGE)
+
+    async def start(self):
+        if not CONF.WEBHOOK_SECRET:
+            # Without a secret, anyone could send fake stream events
+            raise ValueError("WEBHOOK_SECRET is not set, the callbacks cannot be authenticated")
+
+        app = web.Application()
+        app.router.add_post(CONF.WEBHOOK_PATH, self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, CONF.WEBHOOK_HOST, CONF.WEBHOOK_PORT).start()
+        LOG.debug(f"The webhook receiver is listening on {CONF.WEBHOOK_HOST}:{CONF.WEBHOOK_PORT}{CONF.WEBHOOK_PATH}")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def _is_valid(self, headers, body):
+        if not CONF.WEBHOOK_SECRET:
+            return False
+        message_id = headers.get(MESSAGE_ID_HEADER, "")
+        timestamp = headers.get(MESSAGE_TIMESTAMP_HEADER, "")
+        signature = headers.get(MESSAGE_SIGNATURE_HEADER, "")
+        if not hmac.compare_digest(sign(CONF.WEBHOOK_SECRET, message_id, timestamp, body), signature):
+            return False
+        try:
+            return abs(datetime.now(timezone.utc).timestamp() - _parse_timestamp(timestamp)) < MAX_MESSAGE_AGE
+        except ValueError:
+            return False
+
+    async def handle(self, request):
+        body = await request.read()
+        if not self._is_valid(request.headers, body):
+            LOG.warning(f"Invalid webhook callback signature from {request.remote}")
+            return web.Response(status=403)
+
+        message_id = request.headers[MESSAGE_ID_HEADER]
+        if message_id in self.message_ids:
+            return web.Response(status=204)
+        self.message_ids.set(message_id, True)
+
+        try:
+            data = json.loads(body.decode())
+            message_type = request.headers.get(MESSAGE_TYPE_HEADER)
+            subscription = data['subscription']
+
+            if message_type == "webhook_callback_verification":
+                LOG.debug(f"The subscription {subscription['type']} for {subscription['condition']} is verified")
+                return web.Response(text=data['challenge'])
+
+            if message_type == "revocation":
+                LOG.warning(f"The subscription {subscription['type']} for {subscription['condition']} has been "
+                            f"revoked ({subscription['status']})")
+                return web.Response(status=204)
+
+            stream_id = int(data['event']['broadcaster_user_id'])
+            handler = self.on_online if subscription['type'] == ONLINE_EVENT else self.on_offline
+        except (KeyError, TypeError, ValueError) as e:
+            message = "Cannot parse the webhook callback"
+            LOG.error(log.get_log_exception_message(message, e))
+            return web.Response(status=400)
+
+        # Answer immediately, Twitch expects an answer within a few seconds
+        asyncio.ensure_future(self._handle_event(handler, subscription['type'], stream_id), loop=self.loop)
+        return web.Response(status=204)
+
+    @staticmethod
+    async def _handle_event(handler, event_type, stream_id):
+        try:
+            await handler(stream_id)
+        except Exception as e:
+            message = f"Cannot handle the {event_type} event of the stream {stream_id}"
+            LOG.exception(log.get_log_exception_message(message, e))
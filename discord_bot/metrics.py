@@ -0,0 +1,140 @@
+import bisect
+import contextlib
+import time
+
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+LAG_BUCKETS = [1, 2.5, 5, 10, 15, 30, 60, 120, 300, 600]
+
+REGISTRY = []
+
+
+class Histogram:
+    """Count the observed values in cumulative buckets (Prometheus histogram)"""
+
+    type = "histogram"
+
+    def __init__(self, name, description, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = sorted(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.bucket_counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    @contextlib.contextmanager
+    def time(self):
+        """Observe the duration of the block in seconds"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start)
+
+    def get_quantile(self, quantile):
+        """Estimate a quantile as the upper bound of the bucket containing it"""
+        rank = quantile * self.count
+        cumulative_count = 0
+        for bucket, bucket_count in zip(self.buckets, self.bucket_counts):
+            cumulative_count += bucket_count
+            if cumulative_count >= rank:
+                return bucket
+        return float("inf")
+
+    def render(self):
+        lines = []
+        cumulative_count = 0
+        for bucket, bucket_count in zip(self.buckets, self.bucket_counts):
+            cumulative_count += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{bucket}"}} {cumulative_count}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+    def summary(self):
+        if not self.count:
+            return "no data"
+        return f"count={self.count} avg={self.sum / self.count:.3f} p50<={self.get_quantile(0.5)} " \
+               f"p95<={self.get_quantile(0.95)} max={self.max:.3f}"
+
+
+class Gauge:
+    """A value which can go up and down, either set or computed by a function when it is read"""
+
+    type = "gauge"
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function else self.value
+
+    def render(self):
+        return [f"{self.name} {self.get()}"]
+
+    def summary(self):
+        return str(self.get())
+
+
+def _register(metric):
+    """Add a metric in the registry, replacing the metric of the same name (e.g. when a cog is reloaded)"""
+    for index, registered_metric in enumerate(REGISTRY):
+        if registered_metric.name == metric.name:
+            REGISTRY[index] = metric
+            break
+    else:
+        REGISTRY.append(metric)
+    return metric
+
+
+def histogram(name, description, buckets=DURATION_BUCKETS):
+    return _register(Histogram(name, description, buckets))
+
+
+def gauge(name, description):
+    return _register(Gauge(name, description))
+
+
+def render():
+    """Return all the metrics in the Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# STREAM POLLING
+POLL_DURATION = histogram("stream_poll_duration_seconds", "Duration of a polling iteration")
+STATUS_REQUEST_DURATION = histogram("stream_status_request_duration_seconds",
+                                    "Duration of the Twitch API calls retrieving the stream status")
+DB_READ_DURATION = histogram("stream_db_read_duration_seconds", "Duration of the database reads of the stream data")
+DB_WRITE_DURATION = histogram("stream_db_write_duration_seconds", "Duration of the notification writes")
+ONLINE_HANDLER_DURATION = histogram("stream_online_handler_duration_seconds",
+                                    "Duration of the handler called when a stream goes online")
+OFFLINE_HANDLER_DURATION = histogram("stream_offline_handler_duration_seconds",
+                                     "Duration of the handler called when a stream goes offline")
+NOTIFICATION_LAG = histogram("stream_notification_lag_seconds",
+                             "Delay between the start of a stream and the sending of its notification", LAG_BUCKETS)
+TRACKED_STREAMS = gauge("stream_tracked_streams", "Number of tracked streams")
+TRACKED_CHANNELS = gauge("stream_tracked_channels", "Number of discord channels with tracked streams")
+NOTIFICATION_QUEUE_SIZE = gauge("stream_notification_queue_size", "Number of notification jobs waiting")
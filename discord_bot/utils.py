@@ -1,8 +1,6 @@
 import logging
 import os
 
-import aiofiles
-
 from discord_bot import cfg
 
 CONF = cfg.CONF
@@ -33,6 +31,12 @@ def code_block(message):
     return "```" + str(message) + "```"
 
 
-async def write_file(path, content):
-    async with aiofiles.open(path, "w") as f:
-        await f.write(content)
+def chunks(items, size):
+    """Split a list into consecutive lists of at most `size` elements
+
+    :param items: The list to split
+    :param size: The maximum size of each chunk
+    :return: A generator of lists
+    """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
@@ -0,0 +1,89 @@
+"""Send signed Twitch EventSub callbacks to a running webhook receiver
+
+Usage: python -m scripts.fake_eventsub_sender [--url URL] --secret SECRET {verification,online,offline,revocation} ID
+
+The secret must be the WEBHOOK_SECRET of the bot, e.g. to put the stream 12826 online then offline:
+    python -m scripts.fake_eventsub_sender --secret <secret> online 12826
+    python -m scripts.fake_eventsub_sender --secret <secret> offline 12826
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import json
+import uuid
+
+import aiohttp
+
+from discord_bot.cogs.stream import webhook
+
+EVENT_TYPES = {
+    "online": webhook.ONLINE_EVENT,
+    "offline": webhook.OFFLINE_EVENT,
+}
+
+
+def get_payload(kind, stream_id):
+    """Return the message type and the body of a callback
+
+    :param kind: verification, online, offline or revocation
+    :param stream_id: The id of the broadcaster
+    """
+    event_type = EVENT_TYPES.get(kind, webhook.ONLINE_EVENT)
+    subscription = {
+        "id": str(uuid.uuid4()),
+        "type": event_type,
+        "version": "1",
+        "status": "enabled",
+        "condition": {"broadcaster_user_id": str(stream_id)},
+        "transport": {"method": "webhook", "callback": "https://localhost/twitch/eventsub"},
+        "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+    }
+
+    if kind == "verification":
+        return "webhook_callback_verification", {"subscription": subscription, "challenge": uuid.uuid4().hex}
+    if kind == "revocation":
+        subscription["status"] = "authorization_revoked"
+        return "revocation", {"subscription": subscription}
+
+    event = {
+        "broadcaster_user_id": str(stream_id),
+        "broadcaster_user_login": f"stream{stream_id}",
+        "broadcaster_user_name": f"Stream{stream_id}",
+    }
+    if kind == "online":
+        event.update(id=str(uuid.uuid4()), type="live", started_at=subscription["created_at"])
+    return "notification", {"subscription": subscription, "event": event}
+
+
+async def send(url, secret, kind, stream_id):
+    message_type, payload = get_payload(kind, stream_id)
+    body = json.dumps(payload).encode()
+    message_id = str(uuid.uuid4())
+    timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    headers = {
+        "Content-Type": "application/json",
+        webhook.MESSAGE_ID_HEADER: message_id,
+        webhook.MESSAGE_TIMESTAMP_HEADER: timestamp,
+        webhook.MESSAGE_SIGNATURE_HEADER: webhook.sign(secret, message_id, timestamp, body),
+        webhook.MESSAGE_TYPE_HEADER: message_type,
+    }
+
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, data=body, headers=headers) as response:
+            print(f"{message_type} {kind} {stream_id}: {response.status} {await response.text()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send signed Twitch EventSub callbacks to a webhook receiver")
+    parser.add_argument("kind", choices=["verification", "online", "offline", "revocation"])
+    parser.add_argument("stream_id", type=int, help="The id of the broadcaster")
+    parser.add_argument("--url", default="http://localhost:8080/twitch/eventsub", help="The url of the receiver")
+    parser.add_argument("--secret", required=True, help="The WEBHOOK_SECRET of the bot")
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(send(args.url, args.secret, args.kind, args.stream_id))
+
+
+if __name__ == "__main__":
+    main()